@@ -2,7 +2,17 @@ from fastapi import FastAPI, HTTPException, Query, Depends
 from fastapi.responses import FileResponse
 import requests
 import os
-from typing import List, Dict, Any, Optional
+import asyncio
+import base64
+import binascii
+import bisect
+import heapq
+import json
+import sqlite3
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 import logging
 
@@ -18,6 +28,36 @@ FILES_DIR: str = os.getenv("LOCAL_STORAGE_PATH", "/mnt/storage") # Путь мо
 SEARCH_ENGINE_URL: str = os.getenv("MEILI_URL", "http://meilisearch:7700")
 MEILI_API_KEY: Optional[str] = os.getenv("MEILI_MASTER_KEY") # Используйте Master Key или Search API Key
 INDEX_NAME: str = "documents"
+# Шарды: узлы/индексы Meilisearch через запятую в формате "URL|индекс" (индекс можно опустить),
+# например "http://meili1:7700|documents,http://meili2:7700|documents".
+# Если не задано — используется один шард SEARCH_ENGINE_URL/INDEX_NAME.
+MEILI_SHARDS: str = os.getenv("MEILI_SHARDS", "")
+SHARD_TIMEOUT: float = float(os.getenv("MEILI_SHARD_TIMEOUT", "2.0")) # Таймаут ответа одного шарда, сек
+
+def parse_shards(spec: str) -> List[Tuple[str, str]]:
+    """Разбирает строку MEILI_SHARDS в список пар (URL узла, имя индекса)."""
+    shards: List[Tuple[str, str]] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        url, _, index = part.partition("|")
+        shards.append((url.rstrip("/"), index.strip() or INDEX_NAME))
+    return shards or [(SEARCH_ENGINE_URL, INDEX_NAME)]
+
+SHARDS: List[Tuple[str, str]] = parse_shards(MEILI_SHARDS)
+# База данных для подсказок, которую пишет индексатор (см. SUGGEST_INDEX_PATH в indexer.py)
+SUGGEST_INDEX_PATH: str = os.getenv("SUGGEST_INDEX_PATH", "suggest_index.db")
+SUGGEST_RELOAD_SECONDS: float = 2.0 # Как часто проверять, не обновилась ли база подсказок
+SUGGEST_MAX_TERMS: int = 50000 # Сколько самых частых слов держать в памяти
+SUGGEST_TOP_K: int = 20 # Максимум подсказок в ответе
+SNIPPET_WORDS: int = int(os.getenv("SEARCH_SNIPPET_WORDS", "40")) # Длина фрагмента текста в выдаче, слов
+MAX_SEARCH_OFFSET: int = 900 # Meilisearch по умолчанию отдает не больше 1000 результатов (maxTotalHits)
+MAX_SHARD_FETCH: int = 1000 # Предел выборки из одного шарда при дозапросе (тот же maxTotalHits)
+# Поля документа, нужные выдаче (служебные minhash, lsh_bands и т.п. не запрашиваем).
+# Полный content тоже не запрашиваем: Meilisearch все равно кладет в _formatted обрезанный
+# и подсвеченный фрагмент атрибутов из attributesToCrop/attributesToHighlight.
+RESULT_ATTRIBUTES: List[str] = ["id", "file_path", "file_name", "dup_group", "duplicate_of"]
 
 app = FastAPI(
     title="Document Search API",
@@ -37,80 +77,437 @@ def get_search_session() -> requests.Session:
     session.headers.update(headers)
     return session
 
-@app.get("/search", response_model=Dict[str, List[Dict[str, Any]]], summary="Поиск документов")
+class SuggestIndex:
+    """
+    Компактный префиксный индекс для подсказок: отсортированный массив ключей
+    (названия файлов, слова из названий и частые слова документов) с весами.
+    Строится из базы SQLite, которую пишет индексатор, и перестраивается при ее изменении.
+    Диапазон ключей с нужным префиксом находится бинарным поиском, а лучшие по весу
+    ключи в нем - деревом отрезков (максимум на отрезке), поэтому стоимость запроса
+    зависит от числа подсказок, а не от размера диапазона.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.loaded_version: Optional[int] = None
+        self.loaded_at: Optional[float] = None
+        self._checked_at = 0.0
+        # (ключи по возрастанию, номер записи для каждого ключа, записи (текст, вид, id документа, вес),
+        #  вес каждого ключа, дерево отрезков с позицией самого тяжелого ключа). Заменяется целиком,
+        # поэтому lookup без блокировок никогда не видит частично собранный индекс.
+        self._data: Tuple[List[str], List[int], List[Tuple[str, str, Optional[str], int]], List[int], List[int]] = \
+            ([], [], [], [], [])
+        self._lock = threading.Lock()
+
+    def maybe_reload(self) -> None:
+        """
+        Перестраивает индекс, если база подсказок изменилась (проверка не чаще раза в SUGGEST_RELOAD_SECONDS).
+        Первая загрузка синхронная (эндпоинты вызывают ее в отдельном потоке), последующие
+        идут в фоне: пока строится новый индекс, запросы обслуживает старый.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < SUGGEST_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            version = self._read_version()
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось проверить базу подсказок {self.path}: {e}")
+            return
+        if version is None or version == self.loaded_version or not self._lock.acquire(blocking=False):
+            return # Базы еще нет, она не менялась или уже перечитывается
+        if self.loaded_version is None:
+            try:
+                self.load()
+            finally:
+                self._lock.release()
+        else:
+            threading.Thread(target=self._load_and_release, name="suggest-reload", daemon=True).start()
+
+    def _load_and_release(self) -> None:
+        try:
+            self.load()
+        finally:
+            self._lock.release()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not os.path.exists(self.path):
+            return None # Индексатор еще не создал базу (connect создал бы пустую)
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _read_version(self) -> Optional[int]:
+        """Счетчик изменений базы подсказок (его увеличивает индексатор при каждом обновлении)."""
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT value FROM suggest_meta WHERE key = 'version'").fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+
+    def load(self) -> None:
+        try:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute("BEGIN") # Версия и записи - из одного снимка базы
+                row = conn.execute("SELECT value FROM suggest_meta WHERE key = 'version'").fetchone()
+                docs: Dict[str, Dict[str, Any]] = {
+                    doc_id: {"name": name, "path": path, "terms": json.loads(terms)}
+                    for doc_id, name, path, terms in conn.execute("SELECT doc_id, name, path, terms FROM suggest")
+                }
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Не удалось загрузить подсказки из {self.path}: {e}")
+            return
+        self._build(docs)
+        self.loaded_version = row[0] if row else 0
+        self.loaded_at = time.time()
+        logger.info(f"Подсказки загружены: {len(self._data[0])} ключей, ~{self.memory_bytes() // 1024} КБ")
+
+    def _build(self, docs: Dict[str, Dict[str, Any]]) -> None:
+        entries: List[Tuple[str, str, Optional[str], int]] = []
+        keyed: List[Tuple[str, int]] = []
+        term_counts: Dict[str, int] = {}
+        for doc_id, doc in docs.items():
+            title = os.path.splitext(doc.get("name") or doc_id)[0]
+            entries.append((title, "title", doc_id, sys.maxsize)) # Названия выше любых слов
+            keyed.append((title.lower(), len(entries) - 1))
+            for word in title.lower().split()[1:]: # Поиск и по словам внутри названия
+                keyed.append((word, len(entries) - 1))
+            for term, count in doc.get("terms", {}).items():
+                term_counts[term] = term_counts.get(term, 0) + count
+        for term, count in heapq.nlargest(SUGGEST_MAX_TERMS, term_counts.items(), key=lambda item: item[1]):
+            entries.append((term, "term", None, count))
+            keyed.append((term, len(entries) - 1))
+        keyed.sort()
+
+        weights = [entries[entry_no][3] for _, entry_no in keyed]
+        size = len(keyed)
+        tree = [-1] * size + list(range(size)) # Листья - позиции ключей, узлы - позиция максимума поддерева
+        for node in range(size - 1, 0, -1):
+            tree[node] = self._heavier(weights, tree[2 * node], tree[2 * node + 1])
+        self._data = ([key for key, _ in keyed], [entry_no for _, entry_no in keyed], entries, weights, tree)
+
+    @staticmethod
+    def _heavier(weights: List[int], first: int, second: int) -> int:
+        """Позиция более тяжелого ключа; при равенстве - ближайшего по алфавиту."""
+        if first < 0:
+            return second
+        if second < 0:
+            return first
+        if weights[first] > weights[second] or (weights[first] == weights[second] and first < second):
+            return first
+        return second
+
+    @classmethod
+    def _range_max(cls, weights: List[int], tree: List[int], lo: int, hi: int) -> int:
+        """Позиция самого тяжелого ключа в [lo, hi) за O(log n)."""
+        size = len(weights)
+        best = -1
+        lo += size
+        hi += size
+        while lo < hi:
+            if lo & 1:
+                best = cls._heavier(weights, best, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = cls._heavier(weights, best, tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    def lookup(self, prefix: str, limit: int = 8) -> List[Dict[str, Any]]:
+        """
+        Лучшие по весу подсказки, начинающиеся с prefix (без учета регистра).
+        Отрезок ключей делится вокруг очередного максимума, поэтому просматривается
+        O(limit) отрезков независимо от того, сколько ключей подходит под префикс.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        keys, key_entries, entries, weights, tree = self._data
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_left(keys, prefix + "\uffff")
+        found: List[int] = []
+        ranges: List[Tuple[int, int, int, int]] = [] # (-вес, позиция, начало, конец отрезка)
+        if lo < hi:
+            best = self._range_max(weights, tree, lo, hi)
+            ranges.append((-weights[best], best, lo, hi))
+        while ranges and len(found) < limit:
+            _, pos, start, end = heapq.heappop(ranges)
+            if key_entries[pos] not in found: # Одно название может попасть в диапазон по нескольким ключам
+                found.append(key_entries[pos])
+            for sub_lo, sub_hi in ((start, pos), (pos + 1, end)):
+                if sub_lo < sub_hi:
+                    best = self._range_max(weights, tree, sub_lo, sub_hi)
+                    heapq.heappush(ranges, (-weights[best], best, sub_lo, sub_hi))
+        return [
+            {"text": text, "kind": kind, **({"id": doc_id} if doc_id else {})}
+            for text, kind, doc_id, _ in (entries[entry_no] for entry_no in found)
+        ]
+
+    def memory_bytes(self) -> int:
+        """Приблизительный объем памяти структур индекса (каждая строка учитывается один раз)."""
+        keys, key_entries, entries, weights, tree = self._data
+        total = sum(sys.getsizeof(array) for array in (keys, key_entries, entries, weights, tree))
+        seen = set()
+        strings = keys + [text for text, _, _, _ in entries] + [doc_id for _, _, doc_id, _ in entries if doc_id]
+        for value in strings:
+            if id(value) not in seen:
+                seen.add(id(value))
+                total += sys.getsizeof(value)
+        total += sum(sys.getsizeof(entry) for entry in entries)
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        keys, _, entries, _, _ = self._data
+        return {
+            "keys": len(keys),
+            "entries": len(entries),
+            "memory_bytes": self.memory_bytes(),
+            "loaded_at": self.loaded_at,
+            "source": self.path,
+        }
+
+suggest_index = SuggestIndex(SUGGEST_INDEX_PATH)
+
+async def search_shard(session: requests.Session, shard: Tuple[str, str], params: Dict[str, Any]) -> Dict[str, Any]:
+    """Выполняет поиск в одном шарде, не дольше SHARD_TIMEOUT секунд."""
+    url, index = shard
+    search_url = f"{url}/indexes/{index}/search"
+    # requests синхронный, поэтому запрос уходит в отдельный поток, чтобы шарды опрашивались параллельно
+    response = await asyncio.wait_for(
+        asyncio.to_thread(session.post, search_url, json=params, timeout=SHARD_TIMEOUT),
+        timeout=SHARD_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json()
+
+def merge_shard_hits(shard_hits: List[List[Dict[str, Any]]], limit: int,
+                     collapse_duplicates: bool = False, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Сливает ранжированные списки результатов шардов в один и возвращает страницу [offset, offset + limit).
+    Сортирует по _rankingScore, при равенстве (или его отсутствии) — по позиции в выдаче шарда.
+    С collapse_duplicates из каждой группы почти-дубликатов (dup_group) остается лучшая копия
+    (заглушки дубликатов - только если других копий группы в выдаче нет).
+    """
+    ranked = []
+    for shard_no, hits in enumerate(shard_hits):
+        for position, hit in enumerate(hits):
+            score = hit.get("_rankingScore")
+            if not isinstance(score, (int, float)):
+                score = 0.0
+            ranked.append((-score, position, shard_no, hit))
+    ranked.sort(key=lambda item: item[:3])
+    if not collapse_duplicates:
+        return [item[3] for item in ranked[offset:offset + limit]]
+    # Группа занимает место своего лучшего результата, а показывается лучшая копия с текстом:
+    # заглушка дубликата (duplicate_of, без текста) остается, только если других копий нет
+    chosen: Dict[str, Dict[str, Any]] = {}
+    for item in ranked:
+        hit = item[3]
+        group = hit.get("dup_group") or hit.get("id")
+        if group not in chosen or (chosen[group].get("duplicate_of") and not hit.get("duplicate_of")):
+            chosen[group] = hit
+    return list(chosen.values())[offset:offset + limit]
+
+@app.get("/search", response_model=Dict[str, Any], summary="Поиск документов")
 async def search(
     q: str = Query(..., description="Поисковый запрос"),
     limit: int = Query(20, ge=1, le=100, description="Максимальное количество результатов"),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET, description="Сколько результатов пропустить (постранично)"),
+    collapse_duplicates: bool = Query(True, description="Показывать одну копию из группы почти-дубликатов"),
     session: requests.Session = Depends(get_search_session)
-) -> Dict[str, List[Dict[str, Any]]]:
+) -> Dict[str, Any]:
     """
-    Выполняет поиск документов в индексе Meilisearch.
+    Выполняет поиск документов во всех шардах Meilisearch и сливает результаты.
+    Если часть шардов не ответила вовремя, возвращает частичный результат.
+    Текст документа возвращается коротким фрагментом вокруг найденных слов.
     """
-    search_url = f"{SEARCH_ENGINE_URL}/indexes/{INDEX_NAME}/search"
-    params = {"q": q, "limit": limit, "attributesToHighlight": ["content"]} # Запрашиваем подсветку
+    # Запрашиваем подсветку, обрезку текста до фрагмента и оценку релевантности (нужна для слияния).
+    # Каждый шард отдает первые offset + limit результатов: нужная страница может целиком прийтись на один шард.
+    # При схлопывании дубликатов этого может не хватить - только тогда выборка шардов удваивается,
+    # пока не наберется offset + limit групп или шарды не закончатся.
+    wanted = offset + limit
+    fetch = wanted
+    while True:
+        params = {"q": q, "limit": fetch, "attributesToHighlight": ["content"], "showRankingScore": True,
+                  "attributesToCrop": ["content"], "cropLength": SNIPPET_WORDS,
+                  "attributesToRetrieve": RESULT_ATTRIBUTES}
+        responses = await asyncio.gather(
+            *(search_shard(session, shard, params) for shard in SHARDS),
+            return_exceptions=True,
+        )
+
+        shard_hits: List[List[Dict[str, Any]]] = []
+        failed_shards: List[str] = []
+        estimated_total = 0
+        shards_have_more = False # Остались ли у шардов результаты сверх выбранных
+        for (url, index), shard_response in zip(SHARDS, responses):
+            if isinstance(shard_response, BaseException):
+                reason = "таймаут" if isinstance(shard_response, asyncio.TimeoutError) else shard_response
+                logger.warning(f"Шард {url}/indexes/{index} не ответил: {reason}")
+                failed_shards.append(f"{url}|{index}")
+            else:
+                hits_page = shard_response.get("hits", [])
+                shard_total = shard_response.get("estimatedTotalHits") or 0
+                shard_hits.append(hits_page)
+                estimated_total += shard_total
+                shards_have_more = shards_have_more or (len(hits_page) == fetch and shard_total > fetch)
+
+        if not shard_hits:
+            logger.error(f"Ни один шард Meilisearch не ответил на запрос '{q}'")
+            raise HTTPException(status_code=503, detail="Сервис поиска временно недоступен")
+
+        fetched = sum(len(hits_page) for hits_page in shard_hits)
+        merged_all = merge_shard_hits(shard_hits, fetched, collapse_duplicates)
+        # Без схлопывания (или если страница уже полная) хватает одного запроса к шардам
+        if not collapse_duplicates or len(merged_all) >= wanted or not shards_have_more or fetch >= MAX_SHARD_FETCH:
+            break
+        fetch = min(fetch * 2, MAX_SHARD_FETCH)
+
     try:
-        response = session.post(search_url, json=params) # Meilisearch рекомендует POST для поиска с параметрами
-        response.raise_for_status() # Вызовет исключение для кодов 4xx/5xx
-        results = response.json()
-        logger.info(f"Поиск по запросу '{q}' вернул {len(results.get('hits', []))} результатов")
+        merged = merged_all[offset:wanted]
+        logger.info(f"Поиск по запросу '{q}' вернул {len(merged)} результатов "
+                    f"(шардов: {len(shard_hits)} из {len(SHARDS)})")
         # Возвращаем только нужные поля, включая _formatted для подсветки
         hits = []
-        for hit in results.get("hits", []):
-             # Убираем полный content, если он большой, оставляем только id и _formatted
-            formatted_hit = hit.get("_formatted", {"id": hit.get("id", "N/A"), "content": "..."})
+        for hit in merged:
+            # Берем поля документа и поверх них фрагмент с подсветкой из _formatted
+            formatted_hit = {key: value for key, value in hit.items() if not key.startswith("_")}
+            formatted_hit.update(hit.get("_formatted", {}))
+            formatted_hit.setdefault("content", "...")
             formatted_hit["id"] = hit.get("id", "N/A") # Убедимся, что id всегда есть
             hits.append(formatted_hit)
 
-        return {"results": hits}
+        result: Dict[str, Any] = {
+            "results": hits,
+            "offset": offset,
+            "estimated_total": estimated_total,
+            # Продолжение есть, если уже выбрано больше результатов, чем показано, или у шардов остались еще
+            "has_more": (len(merged_all) > wanted or shards_have_more) and wanted <= MAX_SEARCH_OFFSET,
+        }
+        if failed_shards:
+            result["partial"] = True
+            result["failed_shards"] = failed_shards
+        return result
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при обращении к Meilisearch ({search_url}): {e}")
-        raise HTTPException(status_code=503, detail="Сервис поиска временно недоступен")
     except Exception as e:
         logger.error(f"Неожиданная ошибка при поиске: {e}")
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера при поиске")
 
 
-@app.get("/files/{filename}", summary="Получение файла документа")
-async def get_file(filename: str) -> FileResponse:
+def lookup_doc_path(session: requests.Session, doc_id: str) -> Optional[str]:
+    """Ищет file_path документа по ID во всех шардах (нужно для хэшированных ID длинных путей)."""
+    for url, index in SHARDS:
+        try:
+            response = session.get(f"{url}/indexes/{index}/documents/{doc_id}",
+                                   params={"fields": "file_path"}, timeout=SHARD_TIMEOUT)
+            if response.status_code == 404:
+                continue
+            response.raise_for_status()
+            return response.json().get("file_path")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Не удалось получить документ {doc_id} из {url}/indexes/{index}: {e}")
+    return None
+
+def resolve_doc_path(session: requests.Session, doc_id: str) -> Optional[str]:
+    """
+    Возвращает путь файла (относительно FILES_DIR) по ID документа.
+    "p_<base64url пути>" декодируется локально, "h_<sha256>" ищется в Meilisearch,
+    остальные ID считаются старыми (имя файла в корне хранилища).
+    """
+    if doc_id.startswith("p_"):
+        encoded = doc_id[2:]
+        try:
+            return base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+    if doc_id.startswith("h_"):
+        return lookup_doc_path(session, doc_id)
+    return doc_id
+
+@app.get("/files/{doc_id}", summary="Получение файла документа")
+async def get_file(doc_id: str, session: requests.Session = Depends(get_search_session)) -> FileResponse:
     """
-    Возвращает файл по его имени.
+    Возвращает файл по ID документа из результатов поиска.
     Используется для скачивания файлов, найденных через поиск.
     """
-    if not filename or ".." in filename or "/" in filename:
-        logger.warning(f"Попытка доступа к некорректному имени файла: {filename}")
-        raise HTTPException(status_code=400, detail="Некорректное имя файла")
+    # Для h_-ID путь ищется в шардах синхронными запросами - уводим их из event loop, как в /search
+    rel_path = await asyncio.to_thread(resolve_doc_path, session, doc_id) if doc_id else None
+    if not rel_path or rel_path.startswith("/") or ".." in rel_path.split("/"):
+        logger.warning(f"Попытка доступа по некорректному ID документа: {doc_id}")
+        raise HTTPException(status_code=400, detail="Некорректный идентификатор файла")
 
-    file_path = os.path.join(FILES_DIR, filename)
+    file_path = os.path.join(FILES_DIR, rel_path)
     # Проверка безопасности: убеждаемся, что путь действительно внутри FILES_DIR
-    if not os.path.abspath(file_path).startswith(os.path.abspath(FILES_DIR)):
+    files_root = os.path.abspath(FILES_DIR)
+    if os.path.commonpath([os.path.abspath(file_path), files_root]) != files_root:
          logger.error(f"Попытка доступа за пределы разрешенной директории: {file_path}")
          raise HTTPException(status_code=403, detail="Доступ запрещен")
 
     if os.path.exists(file_path) and os.path.isfile(file_path):
-        logger.info(f"Отдаем файл: {filename}")
+        logger.info(f"Отдаем файл: {rel_path}")
         # media_type можно определять более точно, если нужно
-        return FileResponse(file_path, filename=filename)
+        return FileResponse(file_path, filename=os.path.basename(rel_path))
     else:
-        logger.warning(f"Запрошенный файл не найден: {filename} (путь {file_path})")
+        logger.warning(f"Запрошенный файл не найден: {rel_path} (путь {file_path})")
         raise HTTPException(status_code=404, detail="Файл не найден")
 
+async def reload_suggest_index() -> None:
+    """Проверяет обновление подсказок; первая (синхронная) загрузка идет в потоке, не блокируя event loop."""
+    if suggest_index.loaded_version is None:
+        await asyncio.to_thread(suggest_index.maybe_reload)
+    else:
+        suggest_index.maybe_reload()
+
+@app.get("/suggest", summary="Подсказки при вводе запроса")
+async def suggest(
+    q: str = Query(..., min_length=1, description="Начало запроса"),
+    limit: int = Query(8, ge=1, le=SUGGEST_TOP_K, description="Максимальное количество подсказок"),
+) -> Dict[str, Any]:
+    """
+    Возвращает подсказки из префиксного индекса в памяти процесса, без обращения к Meilisearch.
+    """
+    await reload_suggest_index()
+    started = time.perf_counter()
+    suggestions = suggest_index.lookup(q, limit)
+    return {"suggestions": suggestions, "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+@app.get("/suggest/stats", summary="Состояние индекса подсказок")
+async def suggest_stats() -> Dict[str, Any]:
+    """Размер индекса подсказок и занимаемая им память."""
+    await reload_suggest_index()
+    return suggest_index.stats()
+
 # Можно добавить эндпоинт для статуса системы, проверки подключения к MeiliSearch и т.д.
 @app.get("/health", summary="Проверка состояния сервиса")
 async def health_check(session: requests.Session = Depends(get_search_session)) -> Dict[str, str]:
-    """Проверяет доступность бэкенда и Meilisearch."""
+    """Проверяет доступность бэкенда и всех узлов Meilisearch."""
     meili_status = "недоступен"
-    try:
-        health_url = f"{SEARCH_ENGINE_URL}/health"
-        response = session.get(health_url)
-        response.raise_for_status()
-        if response.json().get("status") == "available":
-             meili_status = "доступен"
-    except requests.exceptions.RequestException:
-        pass # Статус останется "недоступен"
-    except Exception as e:
-         logger.error(f"Неожиданная ошибка при проверке здоровья Meilisearch: {e}")
+    node_urls = list(dict.fromkeys(url for url, _ in SHARDS)) # Уникальные узлы в исходном порядке
+    available = 0
+    for node_url in node_urls:
+        try:
+            health_url = f"{node_url}/health"
+            response = session.get(health_url, timeout=SHARD_TIMEOUT)
+            response.raise_for_status()
+            if response.json().get("status") == "available":
+                 available += 1
+        except requests.exceptions.RequestException:
+            pass # Узел считается недоступным
+        except Exception as e:
+             logger.error(f"Неожиданная ошибка при проверке здоровья Meilisearch ({node_url}): {e}")
 
+    if available == len(node_urls):
+        meili_status = "доступен"
+    elif available:
+        meili_status = "частично доступен"
 
     return {"status": "ok", "meilisearch_status": meili_status}
-
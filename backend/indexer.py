@@ -2,6 +2,16 @@ import os
 import requests
 import time
 import logging
+import hashlib
+import base64
+import math
+import re
+import sqlite3
+import socket
+import argparse
+import threading
+import json
+from collections import Counter
 from pathlib import Path
 from typing import Optional, List, Dict, Any, Tuple, Set
 from pdfminer.high_level import extract_text as pdf_extract_text
@@ -23,6 +33,66 @@ SEARCH_ENGINE_URL: str = os.getenv("MEILI_URL", "http://meilisearch:7700")
 MEILI_API_KEY: Optional[str] = os.getenv("MEILI_MASTER_KEY") # Используйте Master Key или Index API Key
 INDEX_NAME: str = "documents"
 BATCH_SIZE: int = 100 # Количество документов для отправки в Meilisearch за раз
+MAX_ID_LENGTH: int = 511 # Ограничение Meilisearch на длину ID документа
+# Нормализация текста перед отправкой (значение "0" отключает соответствующий шаг)
+NORMALIZE_TEXT: bool = os.getenv("INDEX_NORMALIZE", "1") != "0" # Схлопывание пробелов и пустых строк
+NORMALIZE_DEHYPHENATE: bool = os.getenv("INDEX_DEHYPHENATE", "1") != "0" # Склейка переносов "сло-\nво" (только PDF)
+NORMALIZE_STRIP_HEADERS: bool = os.getenv("INDEX_STRIP_HEADERS", "1") != "0" # Удаление повторяющихся колонтитулов
+MAX_DOC_CHARS: int = int(os.getenv("INDEX_MAX_DOC_CHARS", "1000000")) # Лимит символов на документ, 0 - без лимита
+TRUNCATION_MARKER: str = " […]" # Добавляется к обрезанному тексту
+# Поиск почти-дубликатов (одна книга в epub/pdf/txt): MinHash-сигнатуры и LSH-корзины
+# off - не искать; canonical - индексировать только первую копию, остальные загружать
+# заглушками со ссылкой duplicate_of (и dup_group); collapse - индексировать все копии с общим dup_group,
+# а /search оставит по одной копии из группы.
+DEDUP_POLICIES: Tuple[str, ...] = ("off", "canonical", "collapse")
+DEDUP_POLICY: str = os.getenv("INDEX_DEDUP_POLICY", "off")
+DEDUP_THRESHOLD: float = float(os.getenv("INDEX_DEDUP_THRESHOLD", "0.8")) # Минимальная оценка сходства Жаккара
+MINHASH_BINS: int = 64 # Длина сигнатуры
+LSH_BANDS: int = 16 # Полос LSH (по MINHASH_BINS // LSH_BANDS значений в полосе)
+SHINGLE_WORDS: int = 5 # Длина шингла в словах
+# Данные для подсказок /suggest: названия, пути и частые слова документов (база SQLite).
+# Базу читает бэкенд, поэтому путь должен совпадать с SUGGEST_INDEX_PATH в app.py;
+# воркерам на других хостах он обязателен и должен указывать на общую с бэкендом ФС.
+SUGGEST_INDEX_PATH: str = os.getenv("SUGGEST_INDEX_PATH", "suggest_index.db")
+SUGGEST_TERMS_PER_DOC: int = 30 # Сколько самых частых слов документа сохранять
+SUGGEST_MIN_TERM_LENGTH: int = 3 # Более короткие слова в подсказки не попадают
+# Атрибуты, по которым индексатор фильтрует документы:
+# dir_ancestors - выборка поддерева, lsh_bands - кандидаты в дубликаты, duplicate_of - заглушки дубликатов
+FILTERABLE_ATTRIBUTES: List[str] = ["dir_ancestors", "lsh_bands", "duplicate_of"]
+# Служебные поля (сигнатуры, корзины) не должны попадать в полнотекстовый индекс
+SEARCHABLE_ATTRIBUTES: List[str] = ["file_name", "file_path", "content"]
+SETTINGS_TASK_TIMEOUT: float = 60.0 # Сколько ждать применения настроек индекса (задачи Meilisearch асинхронны), сек
+# Шарды: узлы/индексы Meilisearch через запятую в формате "URL|индекс" (индекс можно опустить).
+# Документ попадает в шард по стабильному хэшу своего id, поэтому при изменении
+# списка шардов нужна полная переиндексация.
+MEILI_SHARDS: str = os.getenv("MEILI_SHARDS", "")
+
+def parse_shards(spec: str) -> List[Tuple[str, str]]:
+    """Разбирает строку MEILI_SHARDS в список пар (URL узла, имя индекса)."""
+    shards: List[Tuple[str, str]] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        url, _, index = part.partition("|")
+        shards.append((url.rstrip("/"), index.strip() or INDEX_NAME))
+    return shards or [(SEARCH_ENGINE_URL, INDEX_NAME)]
+
+SHARDS: List[Tuple[str, str]] = parse_shards(MEILI_SHARDS)
+
+# Распределенная индексация (режимы coordinator/worker)
+QUEUE_DB_PATH: str = os.getenv("INDEX_QUEUE_PATH", "index_queue.db") # Файл SQLite-очереди, общий для координатора и воркеров
+QUEUE_BATCH_SIZE: int = int(os.getenv("INDEX_QUEUE_BATCH", "20")) # Сколько заданий воркер берет за раз
+QUEUE_LEASE_SECONDS: float = float(os.getenv("INDEX_QUEUE_LEASE", "300")) # Срок аренды пакета без heartbeat
+QUEUE_MAX_ATTEMPTS: int = 3 # После стольких неудачных попыток задание помечается failed
+QUEUE_POLL_INTERVAL: float = 5.0 # Пауза воркера с --follow при пустой очереди, сек
+
+# Планирование обработки: порядок и отдельная "дорогая" полоса
+SCHEDULE_POLICY: str = os.getenv("INDEX_SCHEDULE_POLICY", "newest") # newest | smallest | scan (порядок обхода)
+PRIORITY_DIR: str = os.getenv("INDEX_PRIORITY_DIR", "") # Папка (относительно FILES_DIR), обрабатываемая первой
+EXPENSIVE_COST: int = int(os.getenv("INDEX_EXPENSIVE_COST", str(20 * 1024 * 1024))) # Порог "дорогого" файла
+FORMAT_COST: Dict[str, int] = {".pdf": 5, ".epub": 2, ".txt": 1} # Относительная стоимость извлечения байта
+FLUSH_SECONDS: float = float(os.getenv("INDEX_FLUSH_SECONDS", "5")) # Как часто отправлять накопленные документы
 
 # --- Функции извлечения текста ---
 
@@ -73,6 +143,220 @@ def extract_text_from_epub(file_path: Path) -> str:
     except Exception as e:
         raise IOError(f"Не удалось обработать EPUB файл {file_path.name}") from e
 
+# --- Нормализация текста ---
+
+_HORIZONTAL_SPACE_RE = re.compile(r"[ \t\r\v\u00a0]+")
+_HYPHEN_BREAK_RE = re.compile(r"(\w)-[ \t]*\n[ \t]*(\w)")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_DIGITS_RE = re.compile(r"\d+")
+
+def _margin_indexes(lines: List[str], lines_per_margin: int = 2) -> List[int]:
+    """Индексы первых и последних непустых строк страницы (у коротких страниц поля меньше)."""
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    size = min(lines_per_margin, (len(non_empty) - 1) // 2)
+    if size <= 0:
+        return []
+    return non_empty[:size] + non_empty[-size:]
+
+def _margin_key(line: str) -> str:
+    # Цифры не учитываются, чтобы "Глава 1 - стр. 12" совпадала на всех страницах
+    return _DIGITS_RE.sub("#", line.strip().lower())
+
+def _find_repeated_margins(pages: List[List[str]]) -> Set[str]:
+    """Находит колонтитулы: строки, которые стоят в начале или конце не менее половины страниц."""
+    counts: Dict[str, int] = {}
+    for lines in pages:
+        for key in {_margin_key(lines[i]) for i in _margin_indexes(lines)}:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(3, len(pages) // 2)
+    return {key for key, count in counts.items() if count >= threshold}
+
+def _strip_margins(lines: List[str], repeated: Set[str]) -> List[str]:
+    """Удаляет колонтитулы из первых и последних непустых строк страницы."""
+    margin = set(_margin_indexes(lines))
+    return [line for i, line in enumerate(lines) if i not in margin or _margin_key(line) not in repeated]
+
+def normalize_text(text: str, collapse: bool = NORMALIZE_TEXT, dehyphenate: bool = NORMALIZE_DEHYPHENATE,
+                   strip_headers: bool = NORMALIZE_STRIP_HEADERS, max_chars: int = MAX_DOC_CHARS) -> str:
+    """
+    Готовит извлеченный текст к индексации: убирает повторяющиеся колонтитулы страниц
+    (страницы PDF разделены \f), склеивает переносы слов (если вторая часть начинается
+    со строчной буквы), схлопывает пробелы и пустые строки и обрезает текст
+    до max_chars с маркером TRUNCATION_MARKER.
+    """
+    pages = [page.split("\n") for page in text.split("\f")]
+    if strip_headers and len(pages) >= 3:
+        repeated = _find_repeated_margins(pages)
+        if repeated:
+            pages = [_strip_margins(lines, repeated) for lines in pages]
+    text = "\n".join("\n".join(lines) for lines in pages)
+
+    if dehyphenate:
+        # Склеиваем только перенос со строчной второй частью, составные слова ("Санкт-\nПетербург") не трогаем
+        text = _HYPHEN_BREAK_RE.sub(lambda m: m.group(1) + m.group(2) if m.group(2).islower() else m.group(0), text)
+    if collapse:
+        text = "\n".join(_HORIZONTAL_SPACE_RE.sub(" ", line).strip() for line in text.split("\n"))
+        text = _BLANK_LINES_RE.sub("\n\n", text)
+    text = text.strip()
+
+    if max_chars and len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars) # Не режем посреди слова, если это возможно
+        text = text[:cut if cut > max_chars // 2 else max_chars].rstrip() + TRUNCATION_MARKER
+    return text
+
+# --- Поиск почти-дубликатов ---
+
+_WORD_RE = re.compile(r"\w+")
+_EMPTY_BIN = 0xFFFFFFFF # Значение пустой ячейки сигнатуры
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+def minhash_signature(text: str, bins: int = MINHASH_BINS) -> List[int]:
+    """
+    MinHash-сигнатура текста по шинглам из SHINGLE_WORDS слов (one-permutation hashing:
+    один хэш на шингл, минимум в каждой из bins ячеек). Регистр, пунктуация и пробелы
+    не учитываются, поэтому копии в разных форматах дают близкие сигнатуры.
+    """
+    words = _WORD_RE.findall(text.lower())
+    signature = [_EMPTY_BIN] * bins
+    for i in range(max(1, len(words) - SHINGLE_WORDS + 1)):
+        value = _hash64(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+        cell = value % bins
+        low = (value >> 32) & 0xFFFFFFFE # Старшие биты, последний обнулен, чтобы не совпасть с _EMPTY_BIN
+        if low < signature[cell]:
+            signature[cell] = low
+    return signature
+
+def estimate_similarity(first: List[int], second: List[int]) -> float:
+    """Оценка сходства Жаккара по двум сигнатурам (ячейки, пустые в обеих, не учитываются)."""
+    compared = matched = 0
+    for a, b in zip(first, second):
+        if a == _EMPTY_BIN and b == _EMPTY_BIN:
+            continue
+        compared += 1
+        matched += a == b
+    return matched / compared if compared else 0.0
+
+def lsh_band_keys(signature: List[int], bands: int = LSH_BANDS) -> List[str]:
+    """Ключи LSH-корзин: документы с совпадающей хотя бы одной полосой - кандидаты в дубликаты."""
+    rows = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        values = signature[band * rows:(band + 1) * rows]
+        if all(value == _EMPTY_BIN for value in values):
+            continue # Слишком короткий текст - пустая полоса совпадала бы у всех
+        digest = hashlib.blake2b(b"".join(v.to_bytes(4, "big") for v in values), digest_size=8).hexdigest()
+        keys.append(f"{band}_{digest}")
+    return keys
+
+def encode_signature(signature: List[int]) -> str:
+    return "".join(f"{value:08x}" for value in signature)
+
+def decode_signature(encoded: str) -> List[int]:
+    return [int(encoded[i:i + 8], 16) for i in range(0, len(encoded), 8)]
+
+class DuplicateDetector:
+    """
+    Находит каноническую копию документа среди уже проиндексированных (через фильтр
+    по lsh_bands в Meilisearch) и обработанных в этом прогоне (локальные LSH-корзины).
+    Сравниваются только кандидаты из общих корзин, а не все документы попарно.
+    """
+
+    def __init__(self, client: Optional[requests.Session] = None, threshold: float = DEDUP_THRESHOLD) -> None:
+        self.client = client
+        self.threshold = threshold
+        self._buckets: Dict[str, List[str]] = {}
+        self._docs: Dict[str, Tuple[List[int], str]] = {} # id -> (сигнатура, id канонической копии)
+        self._lock = threading.Lock()
+
+    def assign(self, doc_id: str, signature: List[int], bands: List[str]) -> str:
+        """Возвращает id канонической копии для документа (его собственный id, если дубликатов нет)."""
+        # Запросы к Meilisearch - без блокировки, чтобы потоки обработки не ждали чужой сети
+        remote = self._fetch_remote_candidates(bands)
+        with self._lock:
+            # Локальные корзины читаются под блокировкой уже после запроса: документы,
+            # зарегистрированные другими потоками за это время, тоже учитываются
+            canonical = self._find_canonical(doc_id, signature, bands, remote) or doc_id
+            self._docs[doc_id] = (signature, canonical)
+            for key in bands:
+                self._buckets.setdefault(key, []).append(doc_id)
+            return canonical
+
+    def _fetch_remote_candidates(self, bands: List[str]) -> Dict[str, Tuple[List[int], str]]:
+        remote: Dict[str, Tuple[List[int], str]] = {}
+        if self.client is None or not bands:
+            return remote
+        for doc in fetch_duplicate_candidates(self.client, bands):
+            if not doc.get("minhash"):
+                continue
+            canonical = doc.get("duplicate_of") or doc.get("dup_group") or doc["id"]
+            remote[doc["id"]] = (decode_signature(doc["minhash"]), canonical)
+        return remote
+
+    def _find_canonical(self, doc_id: str, signature: List[int], bands: List[str],
+                        remote: Dict[str, Tuple[List[int], str]]) -> Optional[str]:
+        candidates: Dict[str, Tuple[List[int], str]] = {}
+        for key in bands:
+            for other_id in self._buckets.get(key, []):
+                candidates[other_id] = self._docs[other_id]
+        for other_id, candidate in remote.items():
+            candidates.setdefault(other_id, candidate) # Данные этого прогона свежее индекса
+
+        best: Optional[Tuple[float, str]] = None
+        for other_id, (other_signature, canonical) in candidates.items():
+            if other_id == doc_id or canonical == doc_id:
+                continue # Переиндексация той же копии
+            similarity = estimate_similarity(signature, other_signature)
+            if similarity >= self.threshold and (best is None or similarity > best[0]):
+                best = (similarity, canonical)
+        return best[1] if best else None
+
+def apply_dedup_policy(document: Dict[str, Any], detector: DuplicateDetector,
+                       policy: str = DEDUP_POLICY) -> bool:
+    """
+    Добавляет в документ сигнатуру и LSH-корзины и применяет политику дубликатов.
+    Возвращает True, если документ оказался дубликатом.
+    """
+    signature = minhash_signature(document["content"])
+    bands = lsh_band_keys(signature)
+    document["minhash"] = encode_signature(signature)
+    document["lsh_bands"] = bands
+    canonical = detector.assign(document["id"], signature, bands)
+    is_duplicate = canonical != document["id"]
+    if policy == "collapse":
+        document["dup_group"] = canonical
+    elif policy == "canonical" and is_duplicate:
+        # Заглушка: файл остается в индексе (для отслеживания mtime и поиска по имени), но без текста.
+        # dup_group нужен, чтобы /search схлопывал заглушку с канонической копией при поиске по имени
+        document["duplicate_of"] = canonical
+        document["dup_group"] = canonical
+        document["content"] = ""
+    return is_duplicate
+
+# --- Идентификаторы документов ---
+
+def make_doc_id(rel_path: str) -> str:
+    """
+    Строит стабильный ID документа из пути относительно FILES_DIR.
+    Обычно это "p_" + base64url пути (обратимо, допустимые для Meilisearch символы);
+    для слишком длинных путей - "h_" + sha256, путь тогда хранится только в поле file_path.
+    """
+    encoded = base64.urlsafe_b64encode(rel_path.encode("utf-8")).decode("ascii").rstrip("=")
+    doc_id = f"p_{encoded}"
+    if len(doc_id) > MAX_ID_LENGTH:
+        doc_id = f"h_{hashlib.sha256(rel_path.encode('utf-8')).hexdigest()}"
+    return doc_id
+
+def dir_ancestors(rel_path: str) -> List[str]:
+    """Список всех родительских папок файла: "a/b/c.txt" -> ["a", "a/b"]."""
+    parts = rel_path.split("/")[:-1]
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+def _filter_string(value: str) -> str:
+    """Экранирует строку для выражения filter Meilisearch."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
 # --- Функции взаимодействия с Meilisearch ---
 
 def get_meili_client() -> requests.Session:
@@ -84,18 +368,153 @@ def get_meili_client() -> requests.Session:
     session.headers.update(headers)
     return session
 
-def get_indexed_files(client: requests.Session) -> Dict[str, float]:
-    """Получает список ID и время модификации проиндексированных файлов из Meilisearch."""
+def shard_for_id(doc_id: str, shard_count: Optional[int] = None) -> int:
+    """Возвращает номер шарда для документа (стабильный хэш id, не зависит от процесса)."""
+    count = shard_count if shard_count is not None else len(SHARDS)
+    digest = hashlib.md5(doc_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+def group_by_shard(doc_ids: List[str]) -> Dict[int, List[str]]:
+    """Раскладывает id документов по номерам шардов."""
+    groups: Dict[int, List[str]] = {}
+    for doc_id in doc_ids:
+        groups.setdefault(shard_for_id(doc_id), []).append(doc_id)
+    return groups
+
+def ensure_index_settings(client: requests.Session) -> None:
+    """
+    Приводит настройки индекса во всех шардах к нужным индексатору: добавляет фильтруемые
+    атрибуты и ограничивает поисковые атрибуты. Запрос на изменение уходит, только если настройки отличаются.
+    Применения фильтруемых атрибутов дожидаемся: сразу после настройки идет выборка с фильтром.
+    """
+    for shard_url, shard_index in SHARDS:
+        base_url = f"{shard_url}/indexes/{shard_index}/settings"
+        try:
+            response = client.get(f"{base_url}/filterable-attributes")
+            current: List[str] = response.json() if response.status_code == 200 else []
+            if not set(FILTERABLE_ATTRIBUTES) <= set(current):
+                # PUT на настройки создает индекс, если его еще нет
+                task_uid = _put_index_setting(client, f"{base_url}/filterable-attributes",
+                                              sorted(set(current) | set(FILTERABLE_ATTRIBUTES)))
+                _wait_for_task(client, shard_url, task_uid)
+
+            response = client.get(f"{base_url}/searchable-attributes")
+            if response.status_code != 200 or response.json() != SEARCHABLE_ATTRIBUTES:
+                _put_index_setting(client, f"{base_url}/searchable-attributes", SEARCHABLE_ATTRIBUTES)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Не удалось обновить настройки индекса '{shard_index}' на {shard_url}: {e}")
+
+def _put_index_setting(client: requests.Session, url: str, value: List[str]) -> Optional[int]:
+    response = client.put(url, json=value)
+    response.raise_for_status()
+    task_uid = response.json().get("taskUid")
+    logger.info(f"Обновлена настройка индекса {url}: {value}. Task UID: {task_uid if task_uid is not None else 'N/A'}")
+    return task_uid
+
+def _wait_for_task(client: requests.Session, shard_url: str, task_uid: Optional[int],
+                   timeout: Optional[float] = None) -> bool:
+    """Ждет завершения задачи Meilisearch. Возвращает True, если задача выполнена успешно."""
+    if not isinstance(task_uid, int):
+        return False # Ответ без taskUid - ждать нечего
+    deadline = time.monotonic() + (SETTINGS_TASK_TIMEOUT if timeout is None else timeout)
+    delay = 0.05
+    while True:
+        response = client.get(f"{shard_url}/tasks/{task_uid}")
+        response.raise_for_status()
+        status = response.json().get("status")
+        if status == "succeeded":
+            return True
+        if status in ("failed", "canceled"):
+            logger.error(f"Задача {task_uid} на {shard_url} завершилась со статусом {status}: {response.json().get('error')}")
+            return False
+        if time.monotonic() >= deadline:
+            logger.warning(f"Задача {task_uid} на {shard_url} не завершилась за отведенное время (статус {status})")
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+def fetch_duplicate_candidates(client: requests.Session, bands: List[str], limit: int = 20) -> List[Dict[str, Any]]:
+    """Возвращает документы из всех шардов, у которых есть хотя бы одна общая LSH-корзина."""
+    body = {
+        "filter": f"lsh_bands IN [{', '.join(_filter_string(key) for key in bands)}]",
+        "fields": ["id", "minhash", "duplicate_of", "dup_group"],
+        "limit": limit,
+    }
+    candidates: List[Dict[str, Any]] = []
+    for shard_url, shard_index in SHARDS:
+        url = f"{shard_url}/indexes/{shard_index}/documents/fetch"
+        try:
+            response = client.post(url, json=body)
+            if response.status_code == 404:
+                continue # Индекс еще не создан
+            response.raise_for_status()
+            candidates.extend(response.json().get("results", []))
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Не удалось получить кандидатов в дубликаты из {url}: {e}")
+    return candidates
+
+def release_duplicates(client: requests.Session, canonical_ids: List[str]) -> None:
+    """
+    Удаляет заглушки дубликатов, ссылающиеся на удаленные канонические копии,
+    чтобы при следующем прогоне одна из копий была проиндексирована полностью.
+    """
+    if not canonical_ids:
+        return
+    stub_ids: List[str] = []
+    for i in range(0, len(canonical_ids), BATCH_SIZE):
+        batch = canonical_ids[i:i + BATCH_SIZE]
+        body = {"filter": f"duplicate_of IN [{', '.join(_filter_string(doc_id) for doc_id in batch)}]",
+                "fields": ["id"], "limit": 1000}
+        for shard_url, shard_index in SHARDS:
+            try:
+                response = client.post(f"{shard_url}/indexes/{shard_index}/documents/fetch", json=body)
+                response.raise_for_status()
+                stub_ids.extend(doc["id"] for doc in response.json().get("results", []))
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Не удалось найти заглушки дубликатов в {shard_url}/indexes/{shard_index}: {e}")
+    if stub_ids:
+        logger.info(f"Удаление {len(stub_ids)} заглушек дубликатов: их канонические копии удалены")
+        delete_from_meili_index(client, stub_ids)
+
+def get_indexed_files(client: requests.Session, subdir: Optional[str] = None) -> Dict[str, float]:
+    """
+    Получает список ID и время модификации проиндексированных файлов из всех шардов Meilisearch.
+    С subdir возвращает только документы из этого поддерева (через фильтр по dir_ancestors).
+    """
+    indexed_files: Dict[str, float] = {}
+    for shard_url, shard_index in SHARDS:
+        indexed_files.update(_get_shard_indexed_files(client, shard_url, shard_index, subdir))
+    scope = f", поддерево '{subdir}'" if subdir else ""
+    logger.info(f"Найдено {len(indexed_files)} документов в индексе '{INDEX_NAME}' (шардов: {len(SHARDS)}{scope}).")
+    return indexed_files
+
+def _get_shard_indexed_files(client: requests.Session, shard_url: str, shard_index: str,
+                             subdir: Optional[str] = None) -> Dict[str, float]:
+    """
+    Получает ID и время модификации документов одного шарда.
+    Если шард отклоняет фильтр по dir_ancestors (настройка еще не применена), поддерево
+    выбирается из полного списка документов.
+    """
     indexed_files: Dict[str, float] = {}
     offset = 0
     limit = 1000 # Получаем по 1000 за раз
-    url = f"{SEARCH_ENGINE_URL}/indexes/{INDEX_NAME}/documents"
-    params = {"limit": limit, "fields": "id,file_mtime"}
+    if subdir:
+        # Выборка поддерева: POST /documents/fetch с фильтром (стоимость пропорциональна размеру поддерева)
+        url = f"{shard_url}/indexes/{shard_index}/documents/fetch"
+        body: Dict[str, Any] = {"limit": limit, "fields": ["id", "file_mtime"],
+                                "filter": f"dir_ancestors = {_filter_string(subdir)}"}
+    else:
+        url = f"{shard_url}/indexes/{shard_index}/documents"
+        params: Dict[str, Any] = {"limit": limit, "fields": "id,file_mtime"}
 
     while True:
         try:
-            params["offset"] = offset
-            response = client.get(url, params=params)
+            if subdir:
+                body["offset"] = offset
+                response = client.post(url, json=body)
+            else:
+                params["offset"] = offset
+                response = client.get(url, params=params)
             response.raise_for_status()
             data = response.json()
             results = data.get("results", [])
@@ -120,59 +539,105 @@ def get_indexed_files(client: requests.Session) -> Dict[str, float]:
         except requests.exceptions.HTTPError as e:
              # Если индекс не найден (404), это нормально при первом запуске
             if e.response.status_code == 404:
-                logger.info(f"Индекс '{INDEX_NAME}' не найден. Будет создан при первой индексации.")
+                logger.info(f"Индекс '{shard_index}' на {shard_url} не найден. Будет создан при первой индексации.")
                 return {} # Возвращаем пустой словарь
+            elif subdir and e.response.status_code == 400:
+                logger.warning(f"Шард {shard_url} отклонил фильтр по поддереву ({e}), выбираем документы без фильтра.")
+                return _get_shard_subtree_unfiltered(client, shard_url, shard_index, subdir)
             else:
                  logger.error(f"Ошибка получения документов из Meilisearch: {e}")
                  raise # Передаем ошибку дальше, т.к. не можем продолжить
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка соединения с Meilisearch ({url}): {e}")
             raise
-    logger.info(f"Найдено {len(indexed_files)} документов в индексе '{INDEX_NAME}'.")
     return indexed_files
 
-def update_meili_index(client: requests.Session, documents: List[Dict[str, Any]]) -> None:
-    """Отправляет пакет документов в Meilisearch для добавления/обновления."""
+def _get_shard_subtree_unfiltered(client: requests.Session, shard_url: str, shard_index: str,
+                                  subdir: str) -> Dict[str, float]:
+    """Документы поддерева через полный обход шарда (стоимость пропорциональна размеру шарда)."""
+    indexed_files: Dict[str, float] = {}
+    url = f"{shard_url}/indexes/{shard_index}/documents"
+    params: Dict[str, Any] = {"limit": 1000, "fields": "id,file_mtime,dir_ancestors", "offset": 0}
+    while True:
+        response = client.get(url, params=params)
+        response.raise_for_status()
+        results = response.json().get("results", [])
+        for doc in results:
+            if subdir in (doc.get("dir_ancestors") or []):
+                mtime = doc.get("file_mtime")
+                indexed_files[doc["id"]] = float(mtime) if isinstance(mtime, (int, float)) else 0.0
+        params["offset"] += len(results)
+        if len(results) < params["limit"]:
+            return indexed_files
+
+def update_meili_index(client: requests.Session, documents: List[Dict[str, Any]]) -> bool:
+    """
+    Отправляет пакет документов в Meilisearch для добавления/обновления, раскладывая их по шардам.
+    Возвращает False, если хотя бы один батч отправить не удалось.
+    """
     if not documents:
-        return
-    url = f"{SEARCH_ENGINE_URL}/indexes/{INDEX_NAME}/documents"
-    try:
-        # Отправляем частями (батчами)
-        for i in range(0, len(documents), BATCH_SIZE):
-            batch = documents[i:i + BATCH_SIZE]
-            response = client.post(url, json=batch)
-            response.raise_for_status()
-            task_info = response.json()
-            logger.info(f"Отправлено {len(batch)} документов на индексацию. Task UID: {task_info.get('taskUid', 'N/A')}")
-            # В продакшене можно добавить мониторинг статуса задачи Meilisearch
-            time.sleep(0.1) # Небольшая пауза между батчами
+        return True
+    success = True
+    shard_docs: Dict[int, List[Dict[str, Any]]] = {}
+    for document in documents:
+        shard_docs.setdefault(shard_for_id(document["id"]), []).append(document)
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при отправке документов в Meilisearch: {e}")
-        # Можно добавить логику повторной попытки или сохранения неудавшихся батчей
+    for shard_no, docs in shard_docs.items():
+        shard_url, shard_index = SHARDS[shard_no]
+        url = f"{shard_url}/indexes/{shard_index}/documents"
+        try:
+            # Отправляем частями (батчами)
+            for i in range(0, len(docs), BATCH_SIZE):
+                batch = docs[i:i + BATCH_SIZE]
+                response = client.post(url, json=batch)
+                response.raise_for_status()
+                task_info = response.json()
+                logger.info(f"Отправлено {len(batch)} документов на индексацию в шард {shard_no}. Task UID: {task_info.get('taskUid', 'N/A')}")
+                # В продакшене можно добавить мониторинг статуса задачи Meilisearch
+                time.sleep(0.1) # Небольшая пауза между батчами
 
-def delete_from_meili_index(client: requests.Session, file_ids: List[str]) -> None:
-    """Удаляет документы из Meilisearch по списку ID."""
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ошибка при отправке документов в Meilisearch (шард {shard_no}): {e}")
+            # Можно добавить логику повторной попытки или сохранения неудавшихся батчей
+            success = False
+    return success
+
+def delete_from_meili_index(client: requests.Session, file_ids: List[str]) -> bool:
+    """
+    Удаляет документы из Meilisearch по списку ID (из того шарда, где они хранятся).
+    Возвращает False, если хотя бы один батч удалить не удалось.
+    """
     if not file_ids:
-        return
-    url = f"{SEARCH_ENGINE_URL}/indexes/{INDEX_NAME}/documents/delete-batch"
-    try:
-        # Удаляем частями (батчами)
-        for i in range(0, len(file_ids), BATCH_SIZE):
-             batch_ids = file_ids[i:i + BATCH_SIZE]
-             response = client.post(url, json=batch_ids)
-             response.raise_for_status()
-             task_info = response.json()
-             logger.info(f"Отправлено {len(batch_ids)} ID на удаление. Task UID: {task_info.get('taskUid', 'N/A')}")
-             time.sleep(0.1) # Небольшая пауза
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при удалении документов из Meilisearch: {e}")
+        return True
+    success = True
+    for shard_no, shard_ids in group_by_shard(file_ids).items():
+        shard_url, shard_index = SHARDS[shard_no]
+        url = f"{shard_url}/indexes/{shard_index}/documents/delete-batch"
+        try:
+            # Удаляем частями (батчами)
+            for i in range(0, len(shard_ids), BATCH_SIZE):
+                 batch_ids = shard_ids[i:i + BATCH_SIZE]
+                 response = client.post(url, json=batch_ids)
+                 response.raise_for_status()
+                 task_info = response.json()
+                 logger.info(f"Отправлено {len(batch_ids)} ID на удаление из шарда {shard_no}. Task UID: {task_info.get('taskUid', 'N/A')}")
+                 time.sleep(0.1) # Небольшая пауза
+
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ошибка при удалении документов из Meilisearch (шард {shard_no}): {e}")
+            success = False
+    return success
 
 # --- Основная логика индексации ---
 
-def process_file(file_path: Path) -> Optional[Dict[str, Any]]:
-    """Обрабатывает один файл: извлекает текст и формирует документ для Meilisearch."""
+def process_file(file_path: Path, base_dir: Optional[Path] = None, report: Optional["RunReport"] = None,
+                 detector: Optional[DuplicateDetector] = None) -> Optional[Dict[str, Any]]:
+    """
+    Обрабатывает один файл: извлекает и нормализует текст и формирует документ для Meilisearch.
+    ID документа строится из пути относительно base_dir (по умолчанию FILES_DIR).
+    Если передан report, в него записывается экономия от нормализации;
+    если передан detector, к документу применяется политика дубликатов DEDUP_POLICY.
+    """
     filename = file_path.name
     content: Optional[str] = None
     file_ext = file_path.suffix.lower()
@@ -203,13 +668,26 @@ def process_file(file_path: Path) -> Optional[Dict[str, Any]]:
         # --- Только если текст успешно извлечен, получаем mtime ---
         file_mtime = file_path.stat().st_mtime # Используем stat() как более надежный способ
 
+        rel_path = file_path.relative_to(base_dir or Path(FILES_DIR)).as_posix()
+        # Переносы по слогам ставит верстка PDF; в txt/epub дефис в конце строки - часть слова ("e-\nmail")
+        normalized = normalize_text(content, dehyphenate=NORMALIZE_DEHYPHENATE and file_ext == ".pdf")
+        if report is not None:
+            report.record_normalization(len(content.encode("utf-8")), len(normalized.encode("utf-8")))
+
         # Формируем документ для Meilisearch
         document = {
-            "id": filename, # Используем имя файла как уникальный ID
-            "content": content.strip(),
+            "id": make_doc_id(rel_path), # ID из относительного пути: одноименные файлы в разных папках не конфликтуют
+            "file_path": rel_path,
+            "file_name": filename,
+            "dir_ancestors": dir_ancestors(rel_path), # Для выборки документов поддерева
+            "content": normalized,
             "file_mtime": file_mtime, # Сохраняем время модификации
             "indexed_at": time.time() # Время последней индексации
         }
+        if detector is not None and apply_dedup_policy(document, detector):
+            logger.info(f"{rel_path} - почти-дубликат {document.get('duplicate_of') or document.get('dup_group')}")
+            if report is not None:
+                report.record_duplicate()
         return document
 
     except (ValueError, IOError, FileNotFoundError, Exception) as e: # Добавим FileNotFoundError на всякий случай
@@ -217,33 +695,58 @@ def process_file(file_path: Path) -> Optional[Dict[str, Any]]:
         logger.error(f"❌ Ошибка обработки файла {filename}: {e}")
         return None # Пропускаем этот файл
 
-def scan_and_index_files() -> None:
-    """Сканирует директорию, сравнивает с индексом и обновляет Meilisearch."""
-    logger.info(f"🚀 Запуск сканирования директории: {FILES_DIR}")
-    target_dir = Path(FILES_DIR)
-    if not target_dir.is_dir():
-        logger.error(f"Директория не найдена: {FILES_DIR}")
-        return
+def resolve_subdir(target_dir: Path, subdir: str) -> Optional[str]:
+    """
+    Нормализует путь поддерева относительно target_dir ("" - корень).
+    Возвращает None, если папки нет или она вне target_dir.
+    """
+    root = target_dir.resolve()
+    scan_root = (root / subdir.strip("/")).resolve()
+    if scan_root != root and root not in scan_root.parents:
+        logger.error(f"Папка {subdir} вне {target_dir}")
+        return None
+    if not scan_root.is_dir():
+        logger.error(f"Папка не найдена: {scan_root}")
+        return None
+    rel = scan_root.relative_to(root).as_posix()
+    return "" if rel == "." else rel
 
-    client = get_meili_client()
+def find_changes(client: requests.Session, target_dir: Path,
+                 subdir: Optional[str] = None) -> Optional[Tuple[List[Path], List[str], int]]:
+    """
+    Сравнивает файлы в директории с индексом.
+    С subdir сканируется и сверяется только это поддерево (путь относительно target_dir).
+    Старые документы с ID = имя файла (без dir_ancestors) в выборку поддерева не попадают
+    и удаляются только полным прогоном.
+    Возвращает (файлы для (пере)индексации, ID для удаления, число неизмененных файлов)
+    или None, если состояние индекса получить не удалось.
+    """
+    scan_root = target_dir
+    if subdir:
+        subdir = resolve_subdir(target_dir, subdir)
+        if subdir is None:
+            return None
+        if subdir:
+            scan_root = target_dir / subdir
 
     # 1. Получаем состояние индекса
     try:
-        indexed_files_mtimes: Dict[str, float] = get_indexed_files(client)
+        indexed_files_mtimes: Dict[str, float] = get_indexed_files(client, subdir or None)
     except Exception as e:
         logger.error(f"Не удалось получить состояние индекса. Прерывание: {e}")
-        return
+        return None
 
     # 2. Сканируем локальные файлы
     local_files_mtimes: Dict[str, float] = {}
-    files_to_process: List[Path] = []
+    files_to_process: Dict[str, Path] = {}
     processed_extensions = {".txt", ".pdf", ".epub"}
 
-    for item in target_dir.rglob('*'): # Рекурсивно обходим все файлы
+    for item in scan_root.rglob('*'): # Рекурсивно обходим все файлы
         if item.is_file() and item.suffix.lower() in processed_extensions:
              try:
-                  local_files_mtimes[item.name] = item.stat().st_mtime
-                  files_to_process.append(item)
+                  doc_id = make_doc_id(item.relative_to(target_dir).as_posix())
+                  local_files_mtimes[doc_id] = item.stat().st_mtime
+                  files_to_process[doc_id] = item
              except FileNotFoundError:
                  logger.warning(f"Файл был удален во время сканирования: {item.name}")
                  continue # Пропускаем, если файл исчез между листингом и stat()
@@ -265,42 +768,617 @@ def scan_and_index_files() -> None:
 
     logger.info(f"К добавлению: {len(files_to_add)}, к обновлению: {len(files_to_update)}, к удалению: {len(files_to_delete)}")
 
-    # 4. Обрабатываем и отправляем добавления/обновления
-    docs_for_meili: List[Dict[str, Any]] = []
     files_requiring_processing: Set[str] = files_to_add.union(files_to_update)
+    changed_files = [path for doc_id, path in files_to_process.items() if doc_id in files_requiring_processing]
+    unchanged_count = len(files_to_process) - len(changed_files)
+    return changed_files, sorted(files_to_delete), unchanged_count
 
-    processed_count = 0
-    skipped_count = 0
-    error_count = 0
+# --- Планирование и отчет о прогоне ---
 
-    for file_path in files_to_process:
-        if file_path.name in files_requiring_processing:
-            processed_count +=1
-            document = process_file(file_path)
-            if document:
-                docs_for_meili.append(document)
-            else:
-                error_count += 1 # Ошибка или не удалось извлечь текст
+def estimate_cost(file_path: Path, file_size: int) -> int:
+    """Оценка стоимости извлечения текста: размер файла с весом формата (PDF самый дорогой)."""
+    return file_size * FORMAT_COST.get(file_path.suffix.lower(), 1)
+
+def schedule_files(files: List[Path], base_dir: Path, policy: str = SCHEDULE_POLICY,
+                   priority_dir: str = PRIORITY_DIR) -> Tuple[List[Path], List[Path]]:
+    """
+    Упорядочивает файлы для обработки и делит их на дешевую и дорогую полосы.
+    Файлы из priority_dir идут первыми, внутри группы порядок задает policy:
+    newest - сначала самые свежие, smallest - сначала самые дешевые, scan - порядок обхода.
+    """
+    priority_prefix = Path(priority_dir.strip("/")).parts if priority_dir else ()
+    cheap: List[Tuple[Tuple[Any, ...], Path]] = []
+    expensive: List[Tuple[Tuple[Any, ...], Path]] = []
+    for position, file_path in enumerate(files):
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            continue # Файл исчез после сканирования
+        cost = estimate_cost(file_path, stat.st_size)
+        in_priority_dir = bool(priority_prefix) and \
+            file_path.relative_to(base_dir).parts[:len(priority_prefix)] == priority_prefix
+        if policy == "newest":
+            order: Any = -stat.st_mtime
+        elif policy == "smallest":
+            order = cost
         else:
-             skipped_count +=1 # Файл не изменился
+            order = position
+        key = (not in_priority_dir, order, position)
+        (expensive if cost >= EXPENSIVE_COST else cheap).append((key, file_path))
+    cheap.sort(key=lambda item: item[0])
+    expensive.sort(key=lambda item: item[0])
+    return [path for _, path in cheap], [path for _, path in expensive]
 
-    logger.info(f"Обработано файлов: {processed_count} (пропущено без изменений: {skipped_count}, ошибки: {error_count})")
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """Процентиль методом ближайшего ранга (список должен быть отсортирован)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
 
-    if docs_for_meili:
-        logger.info(f"Отправка {len(docs_for_meili)} документов в Meilisearch...")
-        update_meili_index(client, docs_for_meili)
-    else:
+class RunReport:
+    """Статистика прогона индексации, в том числе время от начала прогона до появления файла в поиске."""
+
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.processed = 0
+        self.errors = 0
+        self.searchable_after: List[float] = [] # Секунды от начала прогона, по одному значению на документ
+        self.raw_bytes = 0 # Размер извлеченного текста до нормализации
+        self.normalized_bytes = 0 # Размер после нормализации и обрезки
+        self.duplicates = 0 # Найдено почти-дубликатов
+        self._lock = threading.Lock()
+
+    def record_processed(self, success: bool) -> None:
+        with self._lock:
+            self.processed += 1
+            if not success:
+                self.errors += 1
+
+    def record_searchable(self, count: int) -> None:
+        """Отмечает, что count документов приняты Meilisearch (момент отправки, без ожидания задачи)."""
+        elapsed = time.monotonic() - self.started_at
+        with self._lock:
+            self.searchable_after.extend([elapsed] * count)
+
+    def record_normalization(self, raw_bytes: int, normalized_bytes: int) -> None:
+        with self._lock:
+            self.raw_bytes += raw_bytes
+            self.normalized_bytes += normalized_bytes
+
+    def record_duplicate(self) -> None:
+        with self._lock:
+            self.duplicates += 1
+
+    def summary(self) -> str:
+        with self._lock:
+            latencies = sorted(self.searchable_after)
+            saved = self.raw_bytes - self.normalized_bytes
+            saved_percent = 100.0 * saved / self.raw_bytes if self.raw_bytes else 0.0
+            return (f"Обработано файлов: {self.processed} (ошибки: {self.errors}), "
+                    f"отправлено в поиск: {len(latencies)}, время до поиска "
+                    f"p50={_percentile(latencies, 0.5):.1f} с, p95={_percentile(latencies, 0.95):.1f} с, "
+                    f"нормализация сэкономила {saved / 1024:.1f} КБ ({saved_percent:.1f}%), "
+                    f"почти-дубликатов: {self.duplicates}")
+
+# --- Данные для подсказок ---
+
+def suggest_entry(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Запись для файла подсказок: имя, путь и самые частые слова документа."""
+    words = _WORD_RE.findall(document.get("content", "").lower())
+    counts = Counter(word for word in words if len(word) >= SUGGEST_MIN_TERM_LENGTH and not word.isdigit())
+    return {
+        "name": document.get("file_name") or document["id"],
+        "path": document.get("file_path"),
+        "terms": dict(counts.most_common(SUGGEST_TERMS_PER_DOC)),
+    }
+
+def _open_suggest_store(path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Открывает (и при необходимости создает) базу подсказок. Одна строка на документ,
+    поэтому обновление стоит O(измененных документов), а не O(всего архива).
+    Счетчик version в suggest_meta увеличивается при каждом изменении - по нему бэкенд
+    понимает, что индекс подсказок пора перестроить.
+    """
+    conn = sqlite3.connect(path or SUGGEST_INDEX_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL") # Бэкенд читает, пока индексатор пишет
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS suggest (
+            doc_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            path TEXT,
+            terms TEXT NOT NULL            -- JSON: слово -> число вхождений
+        )""")
+    conn.execute("CREATE TABLE IF NOT EXISTS suggest_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    return conn
+
+def update_suggest_index(entries: Dict[str, Dict[str, Any]], deleted_ids: List[str],
+                         path: Optional[str] = None) -> None:
+    """Добавляет/заменяет записи entries и удаляет deleted_ids в базе подсказок."""
+    if not entries and not deleted_ids:
+        return
+    path = path or SUGGEST_INDEX_PATH
+    try:
+        conn = _open_suggest_store(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM suggest WHERE doc_id = ?", [(doc_id,) for doc_id in deleted_ids])
+            conn.executemany(
+                "INSERT OR REPLACE INTO suggest (doc_id, name, path, terms) VALUES (?, ?, ?, ?)",
+                [(doc_id, entry["name"], entry.get("path"), json.dumps(entry.get("terms", {}), ensure_ascii=False))
+                 for doc_id, entry in entries.items()])
+            _bump_suggest_version(conn)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        logger.info(f"Подсказки обновлены в {path}: записей {len(entries)}, удалено {len(deleted_ids)}")
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось обновить подсказки в {path}: {e}")
+
+def _bump_suggest_version(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        INSERT INTO suggest_meta (key, value) VALUES ('version', 1)
+        ON CONFLICT (key) DO UPDATE SET value = value + 1""")
+
+def backfill_suggest_index(client: requests.Session, path: Optional[str] = None) -> int:
+    """
+    Однократно заполняет базу подсказок названиями уже проиндексированных документов
+    (например, при первом запуске на существующей установке, где файлы не менялись).
+    Частые слова таких документов появятся при их переиндексации.
+    Возвращает число добавленных записей.
+    """
+    path = path or SUGGEST_INDEX_PATH
+    try:
+        conn = _open_suggest_store(path)
+    except sqlite3.Error as e:
+        logger.error(f"Не удалось открыть базу подсказок {path}: {e}")
+        return 0
+    try:
+        if conn.execute("SELECT 1 FROM suggest_meta WHERE key = 'backfilled'").fetchone():
+            return 0
+        rows: List[Tuple[str, str, Optional[str], str]] = []
+        for shard_url, shard_index in SHARDS:
+            url = f"{shard_url}/indexes/{shard_index}/documents"
+            params: Dict[str, Any] = {"limit": 1000, "offset": 0, "fields": "id,file_name,file_path"}
+            while True:
+                response = client.get(url, params=params)
+                if response.status_code == 404:
+                    break # Индекс еще не создан
+                response.raise_for_status()
+                results = response.json().get("results", [])
+                rows.extend((doc["id"], doc.get("file_name") or doc["id"], doc.get("file_path"), "{}")
+                            for doc in results)
+                params["offset"] += len(results)
+                if len(results) < params["limit"]:
+                    break
+        conn.execute("BEGIN IMMEDIATE")
+        # Записи, уже созданные индексатором (с частыми словами), не перезаписываем
+        added = conn.executemany(
+            "INSERT OR IGNORE INTO suggest (doc_id, name, path, terms) VALUES (?, ?, ?, ?)", rows).rowcount
+        conn.execute("INSERT OR REPLACE INTO suggest_meta (key, value) VALUES ('backfilled', 1)")
+        _bump_suggest_version(conn)
+        conn.execute("COMMIT")
+        logger.info(f"База подсказок {path} заполнена из Meilisearch: добавлено {added} документов")
+        return added
+    except (requests.exceptions.RequestException, sqlite3.Error) as e:
+        logger.error(f"Не удалось заполнить подсказки из Meilisearch: {e}")
+        return 0
+    finally:
+        conn.close()
+
+class IncrementalUploader:
+    """
+    Копит документы и отправляет их в Meilisearch пачками по BATCH_SIZE, а после start() -
+    еще и по таймеру раз в FLUSH_SECONDS, чтобы файлы становились доступны для поиска
+    по ходу прогона, а не в самом конце. Отправка идет без блокировки, поэтому
+    выгрузка одной полосы не задерживает add() другой.
+    """
+
+    def __init__(self, client: requests.Session, report: RunReport, flush_seconds: float = FLUSH_SECONDS) -> None:
+        self.client = client
+        self.report = report
+        self.flush_seconds = flush_seconds
+        self.sent = 0
+        self.suggest_entries: Dict[str, Dict[str, Any]] = {} # Подсказки для успешно отправленных документов
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Запускает фоновую отправку накопленных документов раз в flush_seconds."""
+        self._timer = threading.Thread(target=self._flush_periodically, name="upload-timer", daemon=True)
+        self._timer.start()
+
+    def close(self) -> None:
+        """Останавливает таймер и отправляет остаток."""
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def add(self, document: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending.append(document)
+            batch = self._take_batch() if len(self._pending) >= BATCH_SIZE else []
+        self._upload(batch)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch = self._take_batch()
+        self._upload(batch)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _upload(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch or not update_meili_index(self.client, batch):
+            return
+        self.report.record_searchable(len(batch))
+        entries = {document["id"]: suggest_entry(document) for document in batch}
+        with self._lock:
+            self.sent += len(batch)
+            self.suggest_entries.update(entries)
+
+def _process_lane(files: List[Path], base_dir: Path, uploader: IncrementalUploader, report: RunReport,
+                  detector: Optional[DuplicateDetector]) -> None:
+    """Последовательно обрабатывает файлы одной полосы."""
+    for file_path in files:
+        document = process_file(file_path, base_dir, report, detector)
+        report.record_processed(document is not None)
+        if document:
+            uploader.add(document)
+
+def scan_and_index_files(subdir: Optional[str] = None) -> None:
+    """
+    Сканирует директорию, сравнивает с индексом и обновляет Meilisearch.
+    С subdir переиндексирует только это поддерево, не трогая остальную часть хранилища.
+    """
+    logger.info(f"🚀 Запуск сканирования директории: {FILES_DIR}" + (f" (поддерево '{subdir}')" if subdir else ""))
+    target_dir = Path(FILES_DIR)
+    if not target_dir.is_dir():
+        logger.error(f"Директория не найдена: {FILES_DIR}")
+        return
+
+    client = get_meili_client()
+    report = RunReport()
+    ensure_index_settings(client)
+    backfill_suggest_index(client) # Только если базы подсказок еще нет
+
+    changes = find_changes(client, target_dir, subdir)
+    if changes is None:
+        return
+    changed_files, files_to_delete, skipped_count = changes
+
+    # 4. Обрабатываем добавления/обновления в порядке приоритета. Дорогие файлы идут
+    # отдельной полосой в своем потоке, чтобы большой PDF не задерживал мелкие файлы.
+    cheap_files, expensive_files = schedule_files(changed_files, target_dir)
+    logger.info(f"Политика '{SCHEDULE_POLICY}': дешевых файлов {len(cheap_files)}, дорогих {len(expensive_files)} "
+                f"(без изменений: {skipped_count})")
+    uploader = IncrementalUploader(client, report)
+    uploader.start()
+    detector = DuplicateDetector(client) if DEDUP_POLICY != "off" else None
+    expensive_lane = threading.Thread(target=_process_lane,
+                                      args=(expensive_files, target_dir, uploader, report, detector),
+                                      name="expensive-lane", daemon=True)
+    expensive_lane.start()
+    _process_lane(cheap_files, target_dir, uploader, report, detector)
+    uploader.flush() # Остаток дешевой полосы не должен ждать, пока закончится дорогая
+    expensive_lane.join()
+    uploader.close()
+
+    if not uploader.sent:
         logger.info("Нет новых или обновленных файлов для индексации.")
 
     # 5. Удаляем устаревшие документы
+    deleted_ids: List[str] = []
     if files_to_delete:
         logger.info(f"Удаление {len(files_to_delete)} устаревших документов из Meilisearch...")
-        delete_from_meili_index(client, list(files_to_delete))
+        if delete_from_meili_index(client, files_to_delete):
+            deleted_ids = files_to_delete
+            if DEDUP_POLICY == "canonical":
+                release_duplicates(client, files_to_delete)
     else:
         logger.info("Нет файлов для удаления из индекса.")
 
+    # 6. Обновляем данные для подсказок /suggest
+    update_suggest_index(uploader.suggest_entries, deleted_ids)
+
+    logger.info(report.summary())
     logger.info("✅ Индексация завершена.")
 
+# --- Распределенная индексация: очередь заданий и воркеры ---
+
+class WorkQueue:
+    """
+    Очередь заданий индексации в SQLite с арендой (lease) пакетов.
+
+    Координатор кладет в очередь измененные файлы и удаления, воркеры забирают
+    пакеты в аренду, продлевают ее heartbeat'ами и подтверждают выполнение.
+    Аренда умершего воркера истекает, и его задания забирает другой воркер.
+    Для воркеров на разных хостах файл базы должен лежать на ФС с рабочими блокировками.
+    """
+
+    def __init__(self, db_path: str = QUEUE_DB_PATH) -> None:
+        self.db_path = db_path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL") # Читатели не блокируют писателей
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS work (
+                    doc_id TEXT PRIMARY KEY,
+                    action TEXT NOT NULL,          -- 'index' или 'delete'
+                    rel_path TEXT,                 -- путь относительно FILES_DIR (для 'index')
+                    file_mtime REAL,
+                    priority REAL NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,          -- 'pending', 'leased' или 'failed'
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS work_claim ON work (status, priority, enqueued_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS work_lease ON work (status, lease_expires)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE при захвате)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, items: List[Dict[str, Any]]) -> int:
+        """
+        Добавляет задания (doc_id, action, rel_path, file_mtime, priority).
+        Уже стоящее в очереди или взятое в работу задание с тем же mtime не дублируется.
+        """
+        now = time.time()
+        rows = [
+            (item["doc_id"], item["action"], item.get("rel_path"), item.get("file_mtime"),
+             item.get("priority", 0.0), now)
+            for item in items
+        ]
+        conn = self._connect()
+        try:
+            before = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("""
+                INSERT INTO work (doc_id, action, rel_path, file_mtime, priority, status, attempts, enqueued_at)
+                VALUES (?, ?, ?, ?, ?, 'pending', 0, ?)
+                ON CONFLICT(doc_id) DO UPDATE SET
+                    action = excluded.action, rel_path = excluded.rel_path,
+                    file_mtime = excluded.file_mtime, priority = excluded.priority,
+                    status = 'pending', lease_owner = NULL, lease_expires = NULL,
+                    attempts = 0, enqueued_at = excluded.enqueued_at
+                WHERE work.action != excluded.action
+                   OR work.file_mtime IS NOT excluded.file_mtime
+                   OR work.status = 'failed'
+                """, rows)
+            conn.execute("COMMIT")
+            return conn.total_changes - before
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str, limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        """
+        Берет в аренду до limit заданий: свободные или с истекшей арендой.
+        Задания, чья аренда истекла после QUEUE_MAX_ATTEMPTS попыток (воркер падает на файле),
+        помечаются failed и больше не выдаются.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE") # Блокируем запись, чтобы два воркера не взяли одно задание
+            conn.execute("""
+                UPDATE work SET status = 'failed', lease_owner = NULL, lease_expires = NULL
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""", (now, QUEUE_MAX_ATTEMPTS))
+            # Два запроса вместо одного с OR: каждый идет по своему индексу и читает не больше limit строк,
+            # а не сортирует всю очередь, пока держит блокировку записи
+            columns = "doc_id, action, rel_path, file_mtime, attempts, priority, enqueued_at"
+            pending = conn.execute(f"""
+                SELECT {columns} FROM work WHERE status = 'pending'
+                ORDER BY priority, enqueued_at LIMIT ?""", (limit,)).fetchall()
+            expired = conn.execute(f"""
+                SELECT {columns} FROM work WHERE status = 'leased' AND lease_expires < ?
+                ORDER BY priority, enqueued_at LIMIT ?""", (now, limit)).fetchall()
+            rows = sorted(pending + expired, key=lambda row: (row["priority"], row["enqueued_at"]))[:limit]
+            conn.executemany("""
+                UPDATE work SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE doc_id = ?""", [(worker_id, now + lease_seconds, row["doc_id"]) for row in rows])
+            conn.execute("COMMIT")
+            return [{key: row[key] for key in ("doc_id", "action", "rel_path", "file_mtime", "attempts")} for row in rows]
+        finally:
+            conn.close()
+
+    def heartbeat(self, worker_id: str, doc_ids: List[str], lease_seconds: float) -> int:
+        """Продлевает аренду заданий воркера. Возвращает число продленных заданий."""
+        return self._update_leased(
+            "UPDATE work SET lease_expires = ? WHERE doc_id = ? AND status = 'leased' AND lease_owner = ?",
+            [(time.time() + lease_seconds, doc_id, worker_id) for doc_id in doc_ids])
+
+    def complete(self, worker_id: str, doc_ids: List[str]) -> int:
+        """Удаляет выполненные задания (если аренда все еще принадлежит воркеру)."""
+        return self._update_leased(
+            "DELETE FROM work WHERE doc_id = ? AND status = 'leased' AND lease_owner = ?",
+            [(doc_id, worker_id) for doc_id in doc_ids])
+
+    def release(self, worker_id: str, doc_ids: List[str]) -> int:
+        """Возвращает задания в очередь после ошибки; после QUEUE_MAX_ATTEMPTS попыток помечает их failed."""
+        return self._update_leased("""
+            UPDATE work SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                lease_owner = NULL, lease_expires = NULL
+            WHERE doc_id = ? AND status = 'leased' AND lease_owner = ?""",
+            [(QUEUE_MAX_ATTEMPTS, doc_id, worker_id) for doc_id in doc_ids])
+
+    def _update_leased(self, sql: str, params: List[Tuple[Any, ...]]) -> int:
+        conn = self._connect()
+        try:
+            before = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(sql, params)
+            conn.execute("COMMIT")
+            return conn.total_changes - before
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Количество заданий по статусам."""
+        conn = self._connect()
+        try:
+            return {row["status"]: row["n"] for row in
+                    conn.execute("SELECT status, COUNT(*) AS n FROM work GROUP BY status")}
+        finally:
+            conn.close()
+
+def enqueue_changed_files(queue: Optional[WorkQueue] = None, subdir: Optional[str] = None) -> int:
+    """
+    Режим координатора: сканирует директорию (или только поддерево subdir) и кладет изменения в очередь.
+    Возвращает число новых заданий.
+    """
+    logger.info(f"🚀 Координатор: сканирование директории {FILES_DIR}" + (f" (поддерево '{subdir}')" if subdir else ""))
+    target_dir = Path(FILES_DIR)
+    if not target_dir.is_dir():
+        logger.error(f"Директория не найдена: {FILES_DIR}")
+        return 0
+
+    client = get_meili_client()
+    ensure_index_settings(client)
+    backfill_suggest_index(client)
+    changes = find_changes(client, target_dir, subdir)
+    if changes is None:
+        return 0
+    changed_files, files_to_delete, _ = changes
+
+    # Приоритет задания - его место в расписании: воркеры берут сначала дешевые файлы, затем дорогие
+    cheap_files, expensive_files = schedule_files(changed_files, target_dir)
+    items: List[Dict[str, Any]] = []
+    for priority, file_path in enumerate(cheap_files + expensive_files):
+        try:
+            file_mtime = file_path.stat().st_mtime
+        except FileNotFoundError:
+            continue # Файл исчез после сканирования
+        rel_path = file_path.relative_to(target_dir).as_posix()
+        items.append({
+            "doc_id": make_doc_id(rel_path),
+            "action": "index",
+            "rel_path": rel_path,
+            "file_mtime": file_mtime,
+            "priority": float(priority),
+        })
+    items.extend({"doc_id": doc_id, "action": "delete"} for doc_id in files_to_delete)
+
+    queue = queue or WorkQueue()
+    added = queue.enqueue(items)
+    logger.info(f"В очередь добавлено {added} заданий (всего изменений: {len(items)}). Состояние очереди: {queue.stats()}")
+    return added
+
+def _heartbeat_loop(queue: WorkQueue, worker_id: str, doc_ids: List[str],
+                    lease_seconds: float, stop: threading.Event) -> None:
+    """Продлевает аренду пакета, пока воркер его обрабатывает."""
+    while not stop.wait(lease_seconds / 3):
+        try:
+            queue.heartbeat(worker_id, doc_ids, lease_seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось продлить аренду ({worker_id}): {e}")
+
+def run_worker(worker_id: str, queue: Optional[WorkQueue] = None,
+               batch_size: int = QUEUE_BATCH_SIZE, lease_seconds: float = QUEUE_LEASE_SECONDS,
+               poll_interval: Optional[float] = None) -> int:
+    """
+    Режим воркера: забирает пакеты из очереди, извлекает текст и отправляет в Meilisearch.
+    Без poll_interval завершается, когда очередь пуста. Возвращает число выполненных заданий.
+    """
+    queue = queue or WorkQueue()
+    client = get_meili_client()
+    target_dir = Path(FILES_DIR)
+    report = RunReport()
+    detector = DuplicateDetector(client) if DEDUP_POLICY != "off" else None
+    suggest_entries: Dict[str, Dict[str, Any]] = {}
+    suggest_deleted: List[str] = []
+    done = 0
+    logger.info(f"🚀 Воркер {worker_id} запущен (пакет {batch_size}, аренда {lease_seconds} с)")
+
+    while True:
+        batch = queue.claim(worker_id, batch_size, lease_seconds)
+        if not batch:
+            # Очередь опустела - самое время обновить файл подсказок
+            update_suggest_index(suggest_entries, suggest_deleted)
+            suggest_entries, suggest_deleted = {}, []
+            if poll_interval is None:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        doc_ids = [item["doc_id"] for item in batch]
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat_loop,
+                                     args=(queue, worker_id, doc_ids, lease_seconds, stop), daemon=True)
+        heartbeat.start()
+        try:
+            docs_for_meili: List[Dict[str, Any]] = []
+            ids_to_delete: List[str] = []
+            for item in batch:
+                if item["action"] == "delete":
+                    ids_to_delete.append(item["doc_id"])
+                    continue
+                document = process_file(target_dir / item["rel_path"], target_dir, report, detector)
+                report.record_processed(document is not None)
+                # Файлы, из которых не удалось извлечь текст, не повторяем:
+                # координатор снова поставит их в очередь при следующем сканировании
+                if document:
+                    docs_for_meili.append(document)
+            uploaded = update_meili_index(client, docs_for_meili) and delete_from_meili_index(client, ids_to_delete)
+            if uploaded and ids_to_delete and DEDUP_POLICY == "canonical":
+                release_duplicates(client, ids_to_delete)
+        except Exception as e:
+            logger.error(f"Воркер {worker_id}: ошибка обработки пакета: {e}")
+            uploaded = False
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if uploaded:
+            done += queue.complete(worker_id, doc_ids)
+            report.record_searchable(len(docs_for_meili))
+            suggest_entries.update((document["id"], suggest_entry(document)) for document in docs_for_meili)
+            for doc_id in ids_to_delete:
+                suggest_entries.pop(doc_id, None)
+                suggest_deleted.append(doc_id)
+        else:
+            queue.release(worker_id, doc_ids)
+
+    logger.info(report.summary())
+    logger.info(f"✅ Воркер {worker_id} завершил работу, выполнено заданий: {done}")
+    return done
+
 
 if __name__ == "__main__":
-    scan_and_index_files()
+    parser = argparse.ArgumentParser(description="Индексация документов в Meilisearch.")
+    parser.add_argument("--mode", choices=["full", "coordinator", "worker"], default="full",
+                        help="full - сканирование и индексация в одном процессе (по умолчанию), "
+                             "coordinator - заполнить очередь заданий, worker - обрабатывать очередь")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="Идентификатор воркера (по умолчанию хост-PID)")
+    parser.add_argument("--follow", action="store_true",
+                        help="Воркер не завершается на пустой очереди, а ждет новые задания")
+    parser.add_argument("--subdir", default=None,
+                        help="Переиндексировать только эту папку (путь относительно LOCAL_STORAGE_PATH)")
+    args = parser.parse_args()
+
+    if DEDUP_POLICY not in DEDUP_POLICIES:
+        parser.error(f"неизвестная INDEX_DEDUP_POLICY '{DEDUP_POLICY}', допустимы: {', '.join(DEDUP_POLICIES)}")
+    if args.mode == "coordinator":
+        enqueue_changed_files(subdir=args.subdir)
+    elif args.mode == "worker":
+        if "SUGGEST_INDEX_PATH" not in os.environ:
+            # Иначе каждый воркер пишет подсказки в свой локальный файл, которого бэкенд не видит
+            parser.error("для --mode worker задайте SUGGEST_INDEX_PATH: путь к базе подсказок на общей с бэкендом ФС")
+        run_worker(args.worker_id, poll_interval=QUEUE_POLL_INTERVAL if args.follow else None)
+    else:
+        scan_and_index_files(args.subdir)
@@ -3,13 +3,19 @@ from fastapi.testclient import TestClient
 from httpx import Response
 from unittest.mock import patch, MagicMock
 import os
+import json
+import base64
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import requests
 
 # Мокирование load_dotenv
 patcher_dotenv_app = patch('dotenv.load_dotenv', return_value=True)
 patcher_dotenv_app.start()
 
-from backend.app import app, get_search_session
+from backend.app import app, get_search_session, merge_shard_hits, parse_shards, SuggestIndex
+from backend import indexer
 
 @pytest.fixture
 def mock_search_session_fixture():
@@ -115,3 +121,233 @@ def test_health_check_meili_fail(client, mock_search_session_fixture):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["meilisearch_status"] == "недоступен"
+
+def test_merge_shard_hits_by_ranking_score():
+    shard_a = [{"id": "a1", "_rankingScore": 0.9}, {"id": "a2", "_rankingScore": 0.4}]
+    shard_b = [{"id": "b1", "_rankingScore": 0.7}]
+    merged = merge_shard_hits([shard_a, shard_b], limit=2)
+    assert [hit["id"] for hit in merged] == ["a1", "b1"]
+
+def test_parse_shards_default_index():
+    shards = parse_shards("http://n1:7700|docs_a, http://n2:7700/")
+    assert shards == [("http://n1:7700", "docs_a"), ("http://n2:7700", "documents")]
+
+class _StandInMeili(BaseHTTPRequestHandler):
+    """Заглушка Meilisearch: отвечает заранее заданными результатами с задержкой."""
+    hits: list = []
+    delay: float = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        body = json.dumps({"hits": self.hits}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stand_in_shards():
+    specs = [
+        ([{"id": "fast1.txt", "_rankingScore": 0.5, "_formatted": {"id": "fast1.txt", "content": "a"}}], 0.0),
+        ([{"id": "fast2.txt", "_rankingScore": 0.8, "_formatted": {"id": "fast2.txt", "content": "b"}}], 0.0),
+        ([{"id": "slow.txt", "_rankingScore": 1.0, "_formatted": {"id": "slow.txt", "content": "c"}}], 1.0),
+    ]
+    servers = []
+    for hits, delay in specs:
+        handler = type("Handler", (_StandInMeili,), {"hits": hits, "delay": delay})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    shards = [(f"http://127.0.0.1:{server.server_address[1]}", "documents") for server in servers]
+    yield shards
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_search_federated_partial_results(stand_in_shards):
+    with patch("backend.app.SHARDS", stand_in_shards), patch("backend.app.SHARD_TIMEOUT", 0.3):
+        response = TestClient(app).get("/search?q=тест")
+    assert response.status_code == 200
+    data = response.json()
+    assert [hit["id"] for hit in data["results"]] == ["fast2.txt", "fast1.txt"]
+    assert data["partial"] is True
+    assert data["failed_shards"] == [f"{stand_in_shards[2][0]}|documents"]
+
+def test_get_file_by_path_id(client, tmp_path):
+    (tmp_path / "2024").mkdir()
+    (tmp_path / "2024" / "report.pdf").write_bytes(b"%PDF")
+    doc_id = "p_" + base64.urlsafe_b64encode("2024/report.pdf".encode()).decode().rstrip("=")
+    with patch("backend.app.FILES_DIR", str(tmp_path)):
+        response = client.get(f"/files/{doc_id}")
+    assert response.status_code == 200
+    assert response.content == b"%PDF"
+    assert "report.pdf" in response.headers["content-disposition"]
+
+def test_get_file_path_id_traversal_rejected(client):
+    doc_id = "p_" + base64.urlsafe_b64encode(b"../secret.txt").decode().rstrip("=")
+    response = client.get(f"/files/{doc_id}")
+    assert response.status_code == 400
+
+def test_get_file_hashed_id_looked_up_in_index(client, mock_search_session_fixture, tmp_path):
+    _, mock_session = mock_search_session_fixture
+    (tmp_path / "deep.txt").write_text("текст")
+    lookup = MagicMock(status_code=200)
+    lookup.json.return_value = {"file_path": "deep.txt"}
+    threads = []
+
+    def shard_get(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return lookup
+
+    mock_session.get.side_effect = shard_get
+    with patch("backend.app.FILES_DIR", str(tmp_path)):
+        response = client.get("/files/h_" + "a" * 64)
+    assert response.status_code == 200
+    assert "/documents/h_" in mock_session.get.call_args.args[0]
+    assert threads[0].startswith("asyncio_") # Запрос к шарду - в пуле потоков, а не в event loop
+
+def test_merge_shard_hits_collapses_duplicate_groups():
+    shard_a = [{"id": "p_epub", "dup_group": "p_epub", "_rankingScore": 0.9}]
+    shard_b = [{"id": "p_pdf", "dup_group": "p_epub", "_rankingScore": 0.8}, {"id": "p_other", "_rankingScore": 0.5}]
+    merged = merge_shard_hits([shard_a, shard_b], limit=10, collapse_duplicates=True)
+    assert [hit["id"] for hit in merged] == ["p_epub", "p_other"]
+    assert len(merge_shard_hits([shard_a, shard_b], limit=10)) == 3
+
+def _write_suggest_file(path, docs, deleted_ids=()):
+    # Базу пишет индексатор - используем его же функцию, чтобы схема у обеих сторон совпадала
+    indexer.update_suggest_index(docs, list(deleted_ids), path=str(path))
+
+@pytest.fixture
+def suggest_docs():
+    return {
+        "p_1": {"name": "Война и мир.epub", "path": "lit/Война и мир.epub", "terms": {"война": 50, "волна": 3}},
+        "p_2": {"name": "Волны.txt", "path": "Волны.txt", "terms": {"волна": 40, "войска": 7}},
+    }
+
+def test_suggest_index_prefix_lookup(tmp_path, suggest_docs):
+    path = tmp_path / "suggest_index.db"
+    _write_suggest_file(path, suggest_docs)
+    index = SuggestIndex(str(path))
+    index.load()
+
+    results = index.lookup("Во", limit=5)
+    assert [item["kind"] for item in results[:2]] == ["title", "title"]
+    assert [item["text"] for item in results[2:]] == ["война", "волна", "войска"]
+    assert index.lookup("волн") == [{"text": "Волны", "kind": "title", "id": "p_2"}, {"text": "волна", "kind": "term"}]
+    assert index.lookup("мир")[0]["id"] == "p_1" # Слово внутри названия
+    assert index.stats()["memory_bytes"] > 0
+
+def test_suggest_lookup_cost_does_not_depend_on_range_size(tmp_path):
+    docs = {
+        f"p_{i}": {"name": f"Книга {i:05d}.txt", "path": f"Книга {i:05d}.txt", "terms": {f"книга{i:05d}": i}}
+        for i in range(3000)
+    }
+    path = tmp_path / "suggest_index.db"
+    _write_suggest_file(path, docs)
+    index = SuggestIndex(str(path))
+    index.load()
+
+    with patch.object(SuggestIndex, "_range_max", wraps=SuggestIndex._range_max) as range_max:
+        results = index.lookup("книга", limit=5)
+    assert [item["text"] for item in results] == ["Книга 00000", "Книга 00001", "Книга 00002", "Книга 00003", "Книга 00004"]
+    assert range_max.call_count <= 2 * 5 + 1 # Отрезков O(limit), а не 6000 совпавших ключей
+    terms = index.lookup("книга0", limit=3)
+    assert [item["text"] for item in terms] == ["книга02999", "книга02998", "книга02997"]
+
+def test_suggest_endpoint_without_database_is_empty(client, tmp_path):
+    index = SuggestIndex(str(tmp_path / "missing.db"))
+    with patch("backend.app.suggest_index", index):
+        assert client.get("/suggest?q=вой").json()["suggestions"] == []
+    assert not (tmp_path / "missing.db").exists() # Бэкенд не создает пустую базу вместо индексатора
+
+def test_suggest_endpoint_reloads_on_change(client, tmp_path, suggest_docs):
+    path = tmp_path / "suggest_index.db"
+    _write_suggest_file(path, suggest_docs)
+    index = SuggestIndex(str(path))
+    with patch("backend.app.suggest_index", index), patch("backend.app.SUGGEST_RELOAD_SECONDS", 0):
+        response = client.get("/suggest?q=вой")
+        assert response.status_code == 200
+        assert [item["text"] for item in response.json()["suggestions"]] == ["Война и мир", "война", "войска"]
+
+        _write_suggest_file(path, {"p_3": {"name": "Войнич.pdf", "path": "Войнич.pdf", "terms": {}}}, ["p_1", "p_2"])
+        client.get("/suggest?q=вой") # Запускает фоновую перезагрузку
+        for _ in range(50):
+            if index.loaded_version == 2:
+                break
+            time.sleep(0.01)
+        assert [item["text"] for item in client.get("/suggest?q=вой").json()["suggestions"]] == ["Войнич"]
+        assert client.get("/suggest/stats").json()["entries"] == 1
+
+def test_merge_shard_hits_prefers_canonical_copy_over_duplicate_stub():
+    stub = {"id": "p_pdf", "duplicate_of": "p_epub", "dup_group": "p_epub", "_rankingScore": 0.95}
+    canonical = {"id": "p_epub", "_rankingScore": 0.9}
+    lone_stub = {"id": "p_txt", "duplicate_of": "p_gone", "dup_group": "p_gone", "_rankingScore": 0.5}
+    merged = merge_shard_hits([[stub, lone_stub], [canonical]], limit=10, collapse_duplicates=True)
+    assert [hit["id"] for hit in merged] == ["p_epub", "p_txt"]
+
+def test_merge_shard_hits_pages_with_offset():
+    shard_a = [{"id": f"a{i}", "_rankingScore": 1.0 - i / 10} for i in range(4)]
+    shard_b = [{"id": f"b{i}", "_rankingScore": 0.95 - i / 10} for i in range(4)]
+    first = merge_shard_hits([shard_a, shard_b], limit=3)
+    second = merge_shard_hits([shard_a, shard_b], limit=3, offset=3)
+    assert [hit["id"] for hit in first] == ["a0", "b0", "a1"]
+    assert [hit["id"] for hit in second] == ["b1", "a2", "b2"]
+
+def test_search_pagination_params(client, mock_search_session_fixture):
+    _, mock_session = mock_search_session_fixture
+    response = client.get("/search?q=тест&limit=1&offset=1")
+    assert response.status_code == 200
+    data = response.json()
+    assert [hit["id"] for hit in data["results"]] == ["another.pdf"]
+    assert data["estimated_total"] == 2
+    assert data["has_more"] is False
+    assert data["results"][0]["content"] == "Еще один <em>тест</em>овый файл"
+    sent = mock_session.post.call_args.kwargs["json"]
+    assert sent["limit"] == 2
+    assert sent["attributesToCrop"] == ["content"]
+    assert "content" not in sent["attributesToRetrieve"] # Полный текст не запрашиваем
+
+def test_search_collapsed_pages_are_full_and_have_more(client, mock_search_session_fixture):
+    _, mock_session = mock_search_session_fixture
+    # 200 результатов в 100 группах дубликатов, копии одной группы идут подряд
+    all_hits = [
+        {"id": f"p_{i}", "dup_group": f"g_{i // 2}", "_rankingScore": 1.0 - i / 1000,
+         "_formatted": {"id": f"p_{i}", "content": "фрагмент"}}
+        for i in range(200)
+    ]
+
+    def shard_search(url, json=None, **kwargs):
+        response = MagicMock()
+        response.json.return_value = {"hits": all_hits[:json["limit"]], "estimatedTotalHits": len(all_hits)}
+        return response
+
+    mock_session.post.side_effect = shard_search
+    data = client.get("/search?q=x&limit=20").json()
+    assert len(data["results"]) == 20
+    assert len({hit["id"] for hit in data["results"]}) == 20
+    assert data["has_more"] is True
+
+    last = client.get("/search?q=x&limit=20&offset=80").json()
+    assert [hit["id"] for hit in last["results"]][-1] == "p_198"
+    assert last["has_more"] is False
+
+@pytest.mark.parametrize("collapse", ["true", "false"])
+def test_search_full_page_needs_one_shard_request(client, mock_search_session_fixture, collapse):
+    _, mock_session = mock_search_session_fixture
+    all_hits = [{"id": f"p_{i}", "_rankingScore": 1.0 - i / 1000} for i in range(100)]
+
+    def shard_search(url, json=None, **kwargs):
+        response = MagicMock()
+        response.json.return_value = {"hits": all_hits[:json["limit"]], "estimatedTotalHits": len(all_hits)}
+        return response
+
+    mock_session.post.side_effect = shard_search
+    data = client.get(f"/search?q=x&limit=20&collapse_duplicates={collapse}").json()
+    assert len(data["results"]) == 20
+    assert data["has_more"] is True
+    assert [call.kwargs["json"]["limit"] for call in mock_session.post.call_args_list] == [20]
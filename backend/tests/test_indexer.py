@@ -2,7 +2,12 @@ import pytest
 from pathlib import Path
 from unittest.mock import patch, MagicMock, mock_open
 import os
+import re
+import json
 import time
+import threading
+import requests
+import sqlite3
 
 patcher_dotenv_indexer = patch('dotenv.load_dotenv', return_value=True)
 patcher_dotenv_indexer.start()
@@ -14,6 +19,12 @@ def stop_indexer_patch():
     yield
     patcher_dotenv_indexer.stop()
 
+@pytest.fixture(autouse=True)
+def suggest_index_path(tmp_path):
+    path = tmp_path / "suggest_index.db"
+    with patch('backend.indexer.SUGGEST_INDEX_PATH', str(path)):
+        yield path
+
 def test_extract_text_from_txt_success():
     mock_content = "Привет, мир!"
     with patch.object(Path, 'read_text', return_value=mock_content) as mock_read:
@@ -88,10 +99,14 @@ def test_process_file_txt_success(mock_time, mock_extract, mock_stat):
     p.suffix = ".txt"
     p.__str__.return_value = "file.txt"
     p.stat.return_value = mock_stat_result
+    p.relative_to.return_value = Path("books/file.txt")
     
     result = indexer.process_file(p)
     
-    assert result["id"] == "file.txt"
+    assert result["id"] == indexer.make_doc_id("books/file.txt")
+    assert result["file_path"] == "books/file.txt"
+    assert result["file_name"] == "file.txt"
+    assert result["dir_ancestors"] == ["books"]
     assert result["content"] == "Content"
     assert result["file_mtime"] == mock_stat_result.st_mtime
     assert result["indexed_at"] == 99999.99
@@ -125,7 +140,9 @@ def test_scan_and_index_new_file(mock_process, mock_delete, mock_update,
     mock_file.suffix = ".txt"
     stat_mock = MagicMock()
     stat_mock.st_mtime = 100.0
+    stat_mock.st_size = 10
     mock_file.stat.return_value = stat_mock
+    mock_file.relative_to.return_value = Path("new.txt")
     
     mock_dir = MagicMock(spec=Path)
     mock_dir.is_dir.return_value = True
@@ -133,7 +150,7 @@ def test_scan_and_index_new_file(mock_process, mock_delete, mock_update,
     MockPath.return_value = mock_dir
     
     mock_process.return_value = {
-        "id": "new.txt",
+        "id": indexer.make_doc_id("new.txt"),
         "content": "content",
         "file_mtime": 100.0,
         "indexed_at": 101.0
@@ -143,3 +160,366 @@ def test_scan_and_index_new_file(mock_process, mock_delete, mock_update,
     
     mock_update.assert_called_once()
     mock_delete.assert_not_called()
+
+def test_shard_for_id_is_stable():
+    assert indexer.shard_for_id("report.pdf", 4) == indexer.shard_for_id("report.pdf", 4)
+    assert {indexer.shard_for_id(f"doc{i}.txt", 3) for i in range(50)} == {0, 1, 2}
+
+@patch('backend.indexer.time.sleep')
+def test_update_meili_index_routes_documents_to_shards(mock_sleep):
+    shards = [("http://n1:7700", "documents"), ("http://n2:7700", "documents")]
+    client = MagicMock()
+    client.post.return_value.json.return_value = {"taskUid": 1}
+    docs = [{"id": f"doc{i}.txt", "content": "x"} for i in range(20)]
+    with patch('backend.indexer.SHARDS', shards):
+        indexer.update_meili_index(client, docs)
+        for call in client.post.call_args_list:
+            url = call.args[0]
+            expected = {shards[indexer.shard_for_id(doc["id"])][0] for doc in call.kwargs["json"]}
+            assert expected == {url.split("/indexes/")[0]}
+    assert client.post.call_count == 2
+
+def test_work_queue_leases_are_exclusive_and_reclaimed(tmp_path):
+    queue = indexer.WorkQueue(str(tmp_path / "queue.db"))
+    items = [{"doc_id": f"doc{i}.txt", "action": "index", "rel_path": f"doc{i}.txt", "file_mtime": 1.0}
+             for i in range(5)]
+    assert queue.enqueue(items) == 5
+    assert queue.enqueue(items) == 0 # То же mtime - дубликатов нет
+
+    first = queue.claim("w1", 3, lease_seconds=60)
+    second = queue.claim("w2", 3, lease_seconds=60)
+    assert len(first) == 3 and len(second) == 2
+    assert not {i["doc_id"] for i in first} & {i["doc_id"] for i in second}
+
+    # Аренда w1 истекла (воркер умер) - задания забирает w3, а подтверждение w1 игнорируется
+    with patch('backend.indexer.time.time', return_value=time.time() + 120):
+        reclaimed = queue.claim("w3", 10, lease_seconds=60)
+    assert {i["doc_id"] for i in first} <= {i["doc_id"] for i in reclaimed}
+    assert queue.complete("w1", [i["doc_id"] for i in first]) == 0
+    assert queue.complete("w3", [i["doc_id"] for i in reclaimed]) == 5
+    assert queue.stats() == {}
+
+def test_work_queue_claim_merges_expired_leases_by_priority(tmp_path):
+    queue = indexer.WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue([{"doc_id": f"doc{i}", "action": "index", "rel_path": f"doc{i}.txt", "file_mtime": 1.0,
+                    "priority": i} for i in range(4)])
+    assert [i["doc_id"] for i in queue.claim("w1", 1, lease_seconds=60)] == ["doc0"]
+    with patch('backend.indexer.time.time', return_value=time.time() + 120):
+        claimed = queue.claim("w2", 2, lease_seconds=60)
+    assert claimed == [
+        {"doc_id": "doc0", "action": "index", "rel_path": "doc0.txt", "file_mtime": 1.0, "attempts": 1},
+        {"doc_id": "doc1", "action": "index", "rel_path": "doc1.txt", "file_mtime": 1.0, "attempts": 0},
+    ]
+
+def test_work_queue_release_marks_failed_after_max_attempts(tmp_path):
+    queue = indexer.WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue([{"doc_id": "bad.pdf", "action": "index", "rel_path": "bad.pdf", "file_mtime": 1.0}])
+    for _ in range(indexer.QUEUE_MAX_ATTEMPTS):
+        assert queue.claim("w1", 1, lease_seconds=60)
+        queue.release("w1", ["bad.pdf"])
+    assert queue.claim("w1", 1, lease_seconds=60) == []
+    assert queue.stats() == {"failed": 1}
+
+def test_work_queue_fails_expired_lease_after_max_attempts(tmp_path):
+    queue = indexer.WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue([{"doc_id": "crash.pdf", "action": "index", "rel_path": "crash.pdf", "file_mtime": 1.0}])
+    now = time.time()
+    # Воркер каждый раз падает на файле, не вызывая release: аренда просто истекает
+    for attempt in range(indexer.QUEUE_MAX_ATTEMPTS):
+        with patch('backend.indexer.time.time', return_value=now + attempt * 120):
+            assert [i["doc_id"] for i in queue.claim(f"w{attempt}", 1, lease_seconds=60)] == ["crash.pdf"]
+    with patch('backend.indexer.time.time', return_value=now + indexer.QUEUE_MAX_ATTEMPTS * 120):
+        assert queue.claim("w_next", 1, lease_seconds=60) == []
+    assert queue.stats() == {"failed": 1}
+
+@patch('backend.indexer.delete_from_meili_index', return_value=True)
+@patch('backend.indexer.update_meili_index', return_value=True)
+@patch('backend.indexer.get_meili_client')
+@patch('backend.indexer.process_file')
+def test_run_worker_drains_queue(mock_process, mock_client, mock_update, mock_delete, tmp_path):
+    queue = indexer.WorkQueue(str(tmp_path / "queue.db"))
+    queue.enqueue([
+        {"doc_id": "a.txt", "action": "index", "rel_path": "sub/a.txt", "file_mtime": 1.0},
+        {"doc_id": "old.txt", "action": "delete"},
+    ])
+    mock_process.return_value = {"id": "a.txt", "content": "text"}
+
+    assert indexer.run_worker("w1", queue=queue, batch_size=10) == 2
+    assert mock_process.call_args.args[0] == Path(indexer.FILES_DIR) / "sub/a.txt"
+    mock_delete.assert_called_once_with(mock_client.return_value, ["old.txt"])
+    assert queue.stats() == {}
+
+def _stat(mtime, size):
+    stat = MagicMock()
+    stat.st_mtime = mtime
+    stat.st_size = size
+    return stat
+
+def test_schedule_files_policies_and_lanes():
+    base = Path("/data")
+    stats = {
+        "old.txt": _stat(1.0, 100),
+        "new.txt": _stat(3.0, 500),
+        "urgent/late.txt": _stat(0.5, 900),
+        "huge.pdf": _stat(2.0, indexer.EXPENSIVE_COST),
+    }
+    files = [base / rel for rel in stats]
+    with patch.object(Path, 'stat', autospec=True, side_effect=lambda p: stats[p.relative_to(base).as_posix()]):
+        cheap, expensive = indexer.schedule_files(files, base, policy="newest")
+        assert [p.name for p in cheap] == ["new.txt", "old.txt", "late.txt"]
+        assert [p.name for p in expensive] == ["huge.pdf"]
+
+        cheap, _ = indexer.schedule_files(files, base, policy="smallest", priority_dir="urgent")
+        assert [p.name for p in cheap] == ["late.txt", "old.txt", "new.txt"]
+
+def test_run_report_percentiles():
+    report = indexer.RunReport()
+    report.searchable_after = [float(i) for i in range(1, 101)]
+    assert "p50=50.0 с, p95=95.0 с" in report.summary()
+
+@patch('backend.indexer.update_meili_index', return_value=True)
+def test_incremental_uploader_flushes_by_batch(mock_update):
+    report = indexer.RunReport()
+    uploader = indexer.IncrementalUploader(MagicMock(), report, flush_seconds=3600)
+    for i in range(indexer.BATCH_SIZE + 1):
+        uploader.add({"id": f"doc{i}.txt"})
+    assert mock_update.call_count == 1 # Первая полная пачка ушла сразу
+    uploader.flush()
+    assert uploader.sent == indexer.BATCH_SIZE + 1
+    assert len(report.searchable_after) == indexer.BATCH_SIZE + 1
+
+def test_make_doc_id_distinguishes_folders_and_is_meili_safe():
+    first = indexer.make_doc_id("2023/report.pdf")
+    second = indexer.make_doc_id("2024/report.pdf")
+    assert first != second
+    assert re.fullmatch(r"[A-Za-z0-9_-]+", first)
+    long_id = indexer.make_doc_id("папка/" * 100 + "report.pdf")
+    assert long_id.startswith("h_") and len(long_id) <= indexer.MAX_ID_LENGTH
+
+@patch('backend.indexer.process_file')
+@patch('backend.indexer.delete_from_meili_index')
+@patch('backend.indexer.update_meili_index', return_value=True)
+@patch('backend.indexer.ensure_index_settings')
+@patch('backend.indexer.get_indexed_files')
+@patch('backend.indexer.get_meili_client')
+def test_scan_subtree_reconciles_only_that_folder(mock_client, mock_get_indexed, mock_settings,
+                                                  mock_update, mock_delete, mock_process, tmp_path):
+    (tmp_path / "inbox").mkdir()
+    (tmp_path / "archive").mkdir()
+    (tmp_path / "inbox" / "new.txt").write_text("новый")
+    (tmp_path / "archive" / "old.txt").write_text("старый")
+    gone_id = indexer.make_doc_id("inbox/gone.txt")
+    mock_get_indexed.return_value = {gone_id: 1.0}
+    mock_process.side_effect = lambda path, base, report, detector: {"id": indexer.make_doc_id(path.relative_to(base).as_posix())}
+
+    with patch('backend.indexer.FILES_DIR', str(tmp_path)):
+        indexer.scan_and_index_files(subdir="inbox/")
+
+    mock_get_indexed.assert_called_once_with(mock_client.return_value, "inbox")
+    assert [call.args[0].name for call in mock_process.call_args_list] == ["new.txt"]
+    mock_delete.assert_called_once_with(mock_client.return_value, [gone_id])
+
+def _json_response(status_code, payload):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(payload).encode("utf-8")
+    return response
+
+def test_ensure_index_settings_waits_for_filterable_attributes_task():
+    client = MagicMock()
+    client.get.side_effect = [
+        _json_response(404, {}), # Индекса еще нет
+        _json_response(200, {"status": "enqueued"}),
+        _json_response(200, {"status": "succeeded"}),
+        _json_response(200, indexer.SEARCHABLE_ATTRIBUTES),
+    ]
+    client.put.return_value = _json_response(202, {"taskUid": 7})
+    with patch('backend.indexer.SHARDS', [("http://meili", "documents")]), patch('backend.indexer.time.sleep'):
+        indexer.ensure_index_settings(client)
+    assert [call.args[0] for call in client.get.call_args_list[1:3]] == ["http://meili/tasks/7"] * 2
+
+def test_get_indexed_files_falls_back_when_subtree_filter_is_rejected():
+    client = MagicMock()
+    client.post.return_value = _json_response(400, {"code": "invalid_document_filter"})
+    client.get.return_value = _json_response(200, {"results": [
+        {"id": "p_in", "file_mtime": 5, "dir_ancestors": ["inbox"]},
+        {"id": "p_out", "file_mtime": 6, "dir_ancestors": ["archive"]},
+        {"id": "p_root", "file_mtime": 7},
+    ]})
+    with patch('backend.indexer.SHARDS', [("http://meili", "documents")]):
+        assert indexer.get_indexed_files(client, "inbox") == {"p_in": 5.0}
+    assert "dir_ancestors" in client.get.call_args.kwargs["params"]["fields"]
+
+def test_scan_subtree_outside_storage_is_rejected(tmp_path):
+    assert indexer.find_changes(MagicMock(), tmp_path, subdir="../etc") is None
+
+def test_normalize_text_strips_headers_hyphens_and_whitespace():
+    bodies = ["строка   один\tс  пробелами и пере-\nносом", "вторая страница", "третья\nстраница", "итог"]
+    pages = [f"Отчет за год\n\n{body}\n\n\n\nСтраница {i}" for i, body in enumerate(bodies, 1)]
+    result = indexer.normalize_text("\f".join(pages), max_chars=0)
+    assert "Отчет за год" not in result
+    assert "Страница" not in result
+    assert "строка один с пробелами и переносом" in result
+    assert "итог" in result
+    assert "\n\n\n" not in result
+
+def test_normalize_text_keeps_hyphenated_compounds():
+    result = indexer.normalize_text("Поезд в Санкт-\nПетербург и пере-\nнос", max_chars=0)
+    assert "Санкт-\nПетербург" in result
+    assert "перенос" in result
+
+@patch('backend.indexer.extract_text_from_pdf', return_value="пере-\nнос")
+@patch('backend.indexer.extract_text_from_txt', return_value="адрес e-\nmail")
+def test_process_file_dehyphenates_only_pdf(mock_txt, mock_pdf, tmp_path):
+    (tmp_path / "doc.txt").write_text("x")
+    (tmp_path / "doc.pdf").write_text("x")
+    assert indexer.process_file(tmp_path / "doc.txt", tmp_path)["content"] == "адрес e-\nmail"
+    assert indexer.process_file(tmp_path / "doc.pdf", tmp_path)["content"] == "перенос"
+
+def test_normalize_text_caps_length_on_word_boundary():
+    result = indexer.normalize_text("слово " * 100, max_chars=50)
+    assert result.endswith(indexer.TRUNCATION_MARKER)
+    assert len(result) <= 50 + len(indexer.TRUNCATION_MARKER)
+    assert result[:-len(indexer.TRUNCATION_MARKER)].split(" ")[-1] == "слово"
+
+@patch('backend.indexer.extract_text_from_txt', return_value="текст    с\n\n\n\nпробелами  ")
+def test_process_file_reports_saved_bytes(mock_extract, tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("x")
+    report = indexer.RunReport()
+    document = indexer.process_file(path, tmp_path, report)
+    assert document["content"] == "текст с\n\nпробелами"
+    assert report.raw_bytes - report.normalized_bytes == len("   ".encode()) + 2 + 2
+    assert "нормализация сэкономила" in report.summary()
+
+BOOK = " ".join(f"слово{i % 97} текст{i % 13} глава{i % 7}" for i in range(600))
+
+def test_minhash_similarity_of_near_duplicates():
+    epub_copy = indexer.minhash_signature(BOOK)
+    pdf_copy = indexer.minhash_signature(BOOK.upper().replace(" ", "  ") + " Издание второе")
+    other = indexer.minhash_signature(" ".join(f"другое{i} слово{i * 7}" for i in range(1800)))
+    assert indexer.estimate_similarity(epub_copy, pdf_copy) >= 0.9
+    assert indexer.estimate_similarity(epub_copy, other) < 0.2
+    assert set(indexer.lsh_band_keys(epub_copy)) & set(indexer.lsh_band_keys(pdf_copy))
+    assert indexer.decode_signature(indexer.encode_signature(epub_copy)) == epub_copy
+
+def test_dedup_canonical_policy_links_duplicate():
+    detector = indexer.DuplicateDetector()
+    original = {"id": "p_a", "content": BOOK}
+    copy = {"id": "p_b", "content": BOOK + " конец"}
+    assert indexer.apply_dedup_policy(original, detector, policy="canonical") is False
+    assert indexer.apply_dedup_policy(copy, detector, policy="canonical") is True
+    assert copy["duplicate_of"] == "p_a"
+    assert copy["dup_group"] == "p_a" # Схлопывается в /search вместе с канонической копией
+    assert copy["content"] == ""
+    assert "duplicate_of" not in original
+
+def test_dedup_uses_indexed_candidates_from_meili():
+    client = MagicMock()
+    indexed_signature = indexer.minhash_signature(BOOK)
+    client.post.return_value.status_code = 200
+    client.post.return_value.json.return_value = {
+        "results": [{"id": "p_old", "minhash": indexer.encode_signature(indexed_signature), "dup_group": "p_old"}]
+    }
+    document = {"id": "p_new", "content": BOOK}
+    assert indexer.apply_dedup_policy(document, indexer.DuplicateDetector(client), policy="collapse") is True
+    assert document["dup_group"] == "p_old"
+    assert "lsh_bands IN" in client.post.call_args.kwargs["json"]["filter"]
+
+def test_dedup_remote_fetch_does_not_block_other_documents():
+    fetch_started = threading.Event()
+    release_fetch = threading.Event()
+
+    def slow_first_fetch(client, bands):
+        if not fetch_started.is_set():
+            fetch_started.set()
+            release_fetch.wait(5) # Медленный шард
+        return []
+
+    detector = indexer.DuplicateDetector(MagicMock())
+    signature = indexer.minhash_signature(BOOK)
+    bands = indexer.lsh_band_keys(signature)
+    with patch('backend.indexer.fetch_duplicate_candidates', side_effect=slow_first_fetch):
+        results = []
+        slow = threading.Thread(target=lambda: results.append(detector.assign("p_slow", signature, bands)))
+        slow.start()
+        assert fetch_started.wait(5)
+        started = time.monotonic()
+        assert detector.assign("p_fast", signature, bands) == "p_fast"
+        assert time.monotonic() - started < 1 # Не ждал запрос другого потока
+        release_fetch.set()
+        slow.join(5)
+    assert results == ["p_fast"] # Документ, зарегистрированный во время запроса, учтен
+
+def test_update_suggest_index_adds_and_removes_entries(suggest_index_path):
+    entry = indexer.suggest_entry({"id": "p_a", "file_name": "Война и мир.txt", "file_path": "lit/Война и мир.txt",
+                                    "content": "Наташа Ростова, Наташа, бал 1812"})
+    assert entry["terms"] == {"наташа": 2, "ростова": 1, "бал": 1}
+    indexer.update_suggest_index({"p_a": entry, "p_b": {"name": "b.txt", "path": "b.txt", "terms": {}}}, [])
+    indexer.update_suggest_index({}, ["p_b"])
+    conn = sqlite3.connect(suggest_index_path)
+    assert conn.execute("SELECT doc_id, terms FROM suggest").fetchall() == [("p_a", json.dumps(entry["terms"], ensure_ascii=False))]
+    assert conn.execute("SELECT value FROM suggest_meta WHERE key = 'version'").fetchone() == (2,)
+    conn.close()
+
+def test_backfill_suggest_index_from_meili_once(suggest_index_path):
+    indexer.update_suggest_index({"p_a": {"name": "a.txt", "path": "a.txt", "terms": {"слово": 3}}}, [])
+    client = MagicMock()
+    client.get.return_value.status_code = 200
+    client.get.return_value.json.return_value = {"results": [
+        {"id": "p_a", "file_name": "a.txt", "file_path": "a.txt"},
+        {"id": "p_b", "file_name": "b.txt", "file_path": "old/b.txt"},
+    ]}
+    with patch('backend.indexer.SHARDS', [("http://meili", "documents")]):
+        assert indexer.backfill_suggest_index(client) == 1
+        assert indexer.backfill_suggest_index(client) == 0 # Повторно Meilisearch не обходим
+    assert client.get.call_count == 1
+    conn = sqlite3.connect(suggest_index_path)
+    rows = dict(conn.execute("SELECT doc_id, terms FROM suggest").fetchall())
+    conn.close()
+    assert rows == {"p_a": '{"слово": 3}', "p_b": "{}"} # Записи индексатора не затерты
+
+@patch('backend.indexer.update_meili_index')
+@patch('backend.indexer.process_file')
+@patch('backend.indexer.ensure_index_settings')
+@patch('backend.indexer.get_indexed_files', return_value={})
+@patch('backend.indexer.get_meili_client')
+def test_cheap_files_do_not_wait_for_slow_expensive_lane(mock_client, mock_get_indexed, mock_settings,
+                                                         mock_process, mock_update, tmp_path):
+    for i in range(5):
+        (tmp_path / f"small{i}.txt").write_text("текст")
+    (tmp_path / "huge.pdf").write_bytes(b"%PDF" * 10)
+    started = time.monotonic()
+    uploads = []
+
+    def slow_process(path, base, report, detector):
+        if path.suffix == ".pdf":
+            time.sleep(1.0)
+        return {"id": path.name, "content": "текст"}
+
+    def record_upload(client, batch):
+        uploads.append((time.monotonic() - started, sorted(doc["id"] for doc in batch)))
+        return True
+
+    mock_process.side_effect = slow_process
+    mock_update.side_effect = record_upload
+    with patch('backend.indexer.FILES_DIR', str(tmp_path)), patch('backend.indexer.EXPENSIVE_COST', 20):
+        indexer.scan_and_index_files()
+
+    first_time, first_ids = uploads[0]
+    assert first_ids == [f"small{i}.txt" for i in range(5)]
+    assert first_time < 0.5
+    assert uploads[-1][1] == ["huge.pdf"]
+
+@patch('backend.indexer.update_meili_index', return_value=True)
+def test_incremental_uploader_flushes_by_timer(mock_update):
+    uploader = indexer.IncrementalUploader(MagicMock(), indexer.RunReport(), flush_seconds=0.05)
+    uploader.start()
+    uploader.add({"id": "doc.txt", "content": "текст"})
+    for _ in range(50):
+        if uploader.sent:
+            break
+        time.sleep(0.01)
+    uploader.close()
+    assert uploader.sent == 1
+    mock_update.assert_called_once()